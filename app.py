@@ -1,31 +1,78 @@
 # SPDX-FileCopyrightText: 2025 Meinhard Kissich
 # SPDX-License-Identifier: MIT
 
+import io
 import os
+import time
 import streamlit as st
 from datetime import datetime
 from pathlib import Path
 from celery import Celery
-from celery.result import AsyncResult
 from config import Config
-from tasks import archive
-import time
+from task.archive import do_archive
+from task.blob_store import blobs
+from task.progress import progress, StageProgress
+from task.worker_config import worker_option
+from pipeline import PdfPipeline, audiobook_file, audiobook_formats, job_output
+import uuid
 
 class App():
     def __init__(self):
         self.config = Config(voices_dir=Path("voices"))
-        self.celery_app = Celery('tasks', broker='redis://localhost:6379/0', backend='redis://localhost:6379/0')
-
-    def __wait_with_spinner(self, task, file:int, of_files:int, step_name:str, step:int, of_steps:int):
-        with st.spinner(f"Processing File ({file+1}/{of_files}) Step {step_name} ({step}/{of_steps})"):
-            while True:
-                task_result = AsyncResult(task.id, app=self.celery_app)
-                if task_result.state == "SUCCESS":
-                    return task_result.result
-                elif task_result.state in ["FAILURE", "REVOKED"]:
-                    st.error(f"Task failed with status: {task_result.state}")
-                    return None
-                time.sleep(1)
+        self.celery_app = Celery('tasks')
+        self.celery_app.config_from_object('celeryconfig')
+        self.pipeline = PdfPipeline(self.celery_app)
+
+    def __follow_progress(self, job_ids, names, stages, on_event=None, task_ids=None):
+        jobs = {job_id: StageProgress(list(stages.keys())) for job_id in job_ids}
+        bars = {job_id: st.empty() for job_id in job_ids}
+        deadline = time.monotonic() + worker_option("JOBS", "running_timeout_hours", 6, float) * 3600
+        checked = time.monotonic()
+        for job_id, event in progress.listen(job_ids):
+            if job_id is not None:
+                jobs[job_id].update(event)
+                self.__render_progress(bars[job_id], names[job_id], jobs[job_id], stages)
+                if on_event is not None:
+                    on_event(event)
+            # timings of the last task arrive after its result, so wait until the streams are quiet
+            elif all(job.finished for job in jobs.values()):
+                break
+            elif time.monotonic() - checked > 5:
+                # revoked tasks and lost workers never publish their failure
+                checked = time.monotonic()
+                for job_id, job in jobs.items():
+                    if job.finished:
+                        continue
+                    error = self.pipeline.failure(job_id, (task_ids or {}).get(job_id, []))
+                    if error is None and checked > deadline:
+                        error = "Timed out"
+                    if error is not None:
+                        job.fail(error)
+                        self.pipeline.abandon(job_id, job.failed["stage"], error)
+                        self.__render_progress(bars[job_id], names[job_id], job, stages)
+        for job_id, job in jobs.items():
+            if job.timing:
+                with st.expander(f"{names[job_id]}: Timing"):
+                    spans = sorted(job.timing.items(), key=lambda s: -s[1])
+                    st.table({"Step": [name for name, _ in spans], "Seconds": [round(seconds, 2) for _, seconds in spans]})
+        return all(job.failed is None for job in jobs.values())
+
+    def __render_progress(self, bar, name, job, stages):
+        if job.failed is not None:
+            bar.error(f"{name}: Step {stages.get(job.failed['stage'], job.failed['stage'])} failed: {job.failed.get('error')}")
+            return
+        if job.current == len(stages):
+            reuse = [f"{stages[stage]} {r['reused']}/{r['reused'] + r['recomputed']}"
+                     for stage in stages if (r := job.state[stage].get("reuse"))]
+            bar.progress(1.0, text=f"{name}: Done" + (f", sections reused: {', '.join(reuse)}" if reuse else ""))
+            return
+        stage = list(stages.keys())[job.current]
+        text = f"{name}: Step {stages[stage]} ({job.current+1}/{len(stages)})"
+        if job.state[stage]["total"]:
+            text += f", Section {len(job.state[stage]['done'])}/{job.state[stage]['total']}"
+        if (eta := job.eta(stage)) is not None:
+            text += f", ETA {int(eta)} s"
+        bar.progress((job.current + job.fraction(stage)) / len(stages), text=text)
 
     def run(self):
         st.set_page_config(page_title="Paper2Go")
@@ -39,28 +86,44 @@ class App():
                 working_dir = Path("data").absolute() / self.unique_dir()
                 st.write("This may take a few minutes, please be patient...")
                 os.makedirs(working_dir, exist_ok=True)
+                config = blobs.offload(self.config.as_dict(), force=True)
+                output_format = self.config.as_dict().get("OUTPUT", {}).get("format", "zip")
+                job_ids, task_ids = {}, {}
                 for i, file in enumerate(source_files):
-                    file_bytes = bytes(file.getbuffer())
-                    task_step_1 = self.__from_pdf_step_1(file_bytes, str(working_dir / "01_extracted.md"))
-                    if (result := self.__wait_with_spinner(task_step_1, i, len(source_files), "PDF to Text Conversion", 1, 3)) is None:
-                        break
-
-                    task_step_2 = self.__from_pdf_step_2(result["markdown"], str(working_dir / "02_script.md"), self.config.as_dict())
-                    if (result := self.__wait_with_spinner(task_step_2, i, len(source_files), "Reformulation", 2, 3)) is None:
-                        break
-
                     os.makedirs(working_dir / "audio" / f"{i}")
-                    task_step_3 = self.__from_text_pipeline(result["titles"], result["script"], str(working_dir / "audio" / f"{i}"), self.config.as_dict())
-                    if (result := self.__wait_with_spinner(task_step_3, i, len(source_files), "Text-to-Speech", 3, 3)) is None:
-                        break
+                    job = self.pipeline.submit(blobs.offload(bytes(file.getbuffer())), working_dir, i, config, uuid.uuid4().hex,
+                                               streaming=self.config.as_dict()["TTS"].get("streaming") == "True",
+                                               output_format=output_format)
+                    if job["attached"]:
+                        self.__link_output(job, working_dir, i, output_format)
+                    if job["state"] == "done":
+                        st.progress(1.0, text=f"{file.name}: Done, converted before with the same settings")
+                    else:
+                        job_ids[job["job_id"]] = file.name
+                        task_ids[job["job_id"]] = job.get("task_ids", [])
+                succeeded = True
+                if job_ids:
+                    with st.spinner(f"Processing {len(job_ids)} File(s)"):
+                        succeeded = self.__follow_progress(list(job_ids.keys()), job_ids, self.pipeline.stages_for(output_format), task_ids=task_ids)
 
                 st.spinner("Preparing Download...")
-                r = archive(str(working_dir / "audio"), str(working_dir / "audio.zip"))
-                with open(working_dir / "audio.zip", "rb") as file:
+                # links to the output of a shared job dangle if that job never finished
+                outputs = [audiobook_file(working_dir, i, output_format) if output_format in audiobook_formats else working_dir / "audio" / f"{i}"
+                           for i in range(len(source_files))]
+                if not succeeded or not all(output.exists() for output in outputs):
+                    st.error("Not all files were converted, there is nothing to download.")
+                elif output_format in audiobook_formats and len(source_files) == 1:
+                    st.download_button(
+                        label="Download Audiobook",
+                        data=outputs[0].read_bytes(),
+                        file_name=f"{Path(source_files[0].name).stem}.{output_format}",
+                        mime="audio/mpeg" if output_format == "mp3" else "audio/mp4"
+                    )
+                else:
                     st.download_button(
                         label="Download Files",
-                        data=file,
-                        file_name=str(working_dir / "audio.zip"),
+                        data=self.__archive(working_dir / ("books" if output_format in audiobook_formats else "audio")),
+                        file_name="audio.zip",
                         mime="application/zip"
                     )
 
@@ -70,33 +133,31 @@ class App():
             if source_text:
                 working_dir = Path("data").absolute() / self.unique_dir()
                 os.makedirs(working_dir, exist_ok=True)
+                config = blobs.offload(self.config.as_dict(), force=True)
+                job_id = uuid.uuid4().hex
+                succeeded = True
                 if summarize:
-                    task = self. __from_pdf_step_2("## Title" + source_text, str(working_dir), self.config.as_dict())
+                    task = self. __from_pdf_step_2("## Title" + source_text, str(working_dir), config, job_id)
+                    with st.spinner(f"Processing..."):
+                        succeeded = self.__follow_progress([job_id], {job_id: "Text"}, {"llm": "Reformulation"}, task_ids={job_id: [task.id]})
+                    if succeeded:
+                        script = blobs.resolve(task.get()["script"])
+                        st.write(script)
+
+                if succeeded:
+                    task = self.__from_text_pipeline(["tts"], [" ".join(script)] if summarize else [source_text], str(working_dir), config, job_id)
+                    chunks = st.container()
+                    def play_chunk(event):
+                        # segments are removed once the section is done, the complete file is played below
+                        if event["state"] == "CHUNK" and os.path.isfile(event["file"]):
+                            chunks.audio(event["file"], format="audio/mpeg", loop=False, autoplay=event["chunk"] == 0)
                     with st.spinner(f"Processing..."):
-                        while True:
-                            task_result = AsyncResult(task.id, app=self.celery_app)
-                            if task_result.state == "SUCCESS":
-                                st.write(task_result.get()["script"])
-                                break
-                            elif task_result.state in ["FAILURE", "REVOKED"]:
-                                st.error(f"Task failed with status: {task_result.state}")
-                                break
-                            time.sleep(1)
-
-                task = self.__from_text_pipeline(["tts"], task_result.get()["script"] if summarize else [source_text], str(working_dir), self.config.as_dict())
-                with st.spinner(f"Processing..."):
-                    while True:
-                        task_result = AsyncResult(task.id, app=self.celery_app)
-                        if task_result.state == "SUCCESS":
-                            result = task_result.result
-                            st.success(f"Done 💬✅")
-                            break
-                        elif task_result.state in ["FAILURE", "REVOKED"]:
-                            st.error(f"Task failed with status: {task_result.state}")
-                            break
-                        time.sleep(1)
-
-                st.audio(working_dir/"0-tts.mp3", format="audio/mpeg", loop=False)
+                        succeeded = self.__follow_progress([job_id], {job_id: "Text"}, {"tts": "Text-to-Speech"}, on_event=play_chunk,
+                                                           task_ids={job_id: [task.id]})
+
+                if succeeded:
+                    st.success(f"Done 💬✅")
+                    st.audio(working_dir/"0-tts.mp3", format="audio/mpeg", loop=False)
 
         self.config.config_ui()
         
@@ -104,14 +165,24 @@ class App():
         st.sidebar.write("Paper2Go converts a PDF to Markdown, re-formulates it, synthesizes it into speech, and converts it to MP3 audio.")        
         self.footer()
 
-    def __from_text_pipeline(self, titles, texts, working_dir, config):
-        return self.celery_app.send_task('tasks.make_tts', args=[titles, texts, working_dir, config])
+    def __from_text_pipeline(self, titles, texts, working_dir, config, job_id):
+        return self.celery_app.send_task('tasks.make_tts', args=[titles, texts, working_dir, config], kwargs={"job_id": job_id})
+
+    def __from_pdf_step_2(self, script, working_dir, config, job_id):
+        return self.celery_app.send_task('tasks.make_listenable', args=[script, config, None], kwargs={"job_id": job_id})
 
-    def __from_pdf_step_1(self, file_bytes, working_dir):
-        return self.celery_app.send_task('tasks.convert_to_markdown', args=[file_bytes, working_dir])
+    def __link_output(self, job, working_dir, nr, output_format):
+        # the results of a shared job stay where its first submission put them
+        os.rmdir(working_dir / "audio" / f"{nr}")
+        link = audiobook_file(working_dir, nr, output_format) if output_format in audiobook_formats else working_dir / "audio" / f"{nr}"
+        os.makedirs(link.parent, exist_ok=True)
+        os.symlink(job_output(job, output_format), link)
 
-    def __from_pdf_step_2(self, script, working_dir, config):
-        return self.celery_app.send_task('tasks.make_listenable', args=[script, config, None])
+    @staticmethod
+    def __archive(idir):
+        archive = io.BytesIO()
+        do_archive(str(idir), archive)
+        return archive.getvalue()
 
     def unique_dir(self):
         return datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")[:-3]
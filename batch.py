@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import argparse
+import configparser
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from celery import Celery
+from pipeline import PdfPipeline, job_output
+from task.blob_store import blobs
+from task.disk_cache import hash_bytes
+from task.progress import progress, StageProgress
+
+
+def load_config(config_path):
+    parser = configparser.ConfigParser()
+    parser.read(config_path)
+    return {section: dict(parser.items(section)) for section in parser.sections()}
+
+def find_documents(inputs, default_priority):
+    """Collects (pdf, priority) pairs from directories of PDFs and list files with one 'path [priority]' per line."""
+    documents = []
+    for source in map(Path, inputs):
+        if source.is_dir():
+            documents += [(pdf, default_priority) for pdf in sorted(source.rglob("*.pdf"))]
+        elif source.suffix.lower() == ".pdf":
+            documents.append((source, default_priority))
+        else:
+            for line in map(str.strip, source.read_text().splitlines()):
+                if line == "" or line.startswith("#"):
+                    continue
+                parts = line.rsplit(maxsplit=1)
+                if len(parts) == 2 and parts[1].isdigit():
+                    documents.append((source.parent / parts[0], int(parts[1])))
+                else:
+                    documents.append((source.parent / line, default_priority))
+    return list({str(pdf): (pdf, priority) for pdf, priority in documents}.values())
+
+
+class BatchRunner:
+    """Submits many PDFs through the PdfPipeline with bounded concurrency and keeps a checkpoint to resume after a crash."""
+
+    def __init__(self, celery_app, config_dict, working_dir, max_in_flight=4):
+        self.pipeline = PdfPipeline(celery_app)
+        self.config_dict = config_dict
+        self.working_dir = Path(working_dir).absolute()
+        self.max_in_flight = max_in_flight
+        self.output_format = config_dict.get("OUTPUT", {}).get("format", "zip")
+        self.stages = self.pipeline.stages_for(self.output_format)
+        self.checkpoint_path = self.working_dir / "checkpoint.json"
+        os.makedirs(self.working_dir, exist_ok=True)
+        self.checkpoint = json.loads(self.checkpoint_path.read_text()) if self.checkpoint_path.is_file() else {}
+
+    def save_checkpoint(self):
+        tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        tmp.write_text(json.dumps(self.checkpoint, indent=1))
+        os.replace(tmp, self.checkpoint_path)
+
+    @staticmethod
+    def document_id(pdf):
+        # PDFs of the same name in different directories must not share an output
+        return Path(pdf).stem.replace(" ", "_") + "-" + hash_bytes(str(Path(pdf).absolute()).encode())[:8]
+
+    def submit(self, pdf, priority, config):
+        nr = self.document_id(pdf)
+        os.makedirs(self.working_dir / "audio" / nr, exist_ok=True)
+        job = self.pipeline.submit(blobs.offload(Path(pdf).read_bytes()), self.working_dir, nr, config, uuid.uuid4().hex,
+                                   streaming=self.config_dict["TTS"].get("streaming") == "True",
+                                   output_format=self.output_format, priority=priority)
+        # identical documents share one job, the output is where that job writes it
+        self.checkpoint[str(pdf)] = {"status": "done" if job["state"] == "done" else "running", "job_id": job["job_id"],
+                                     "priority": priority, "submitted": time.time(), "stages": {},
+                                     "output": str(job_output(job, self.output_format))}
+        self.save_checkpoint()
+        return job
+
+    def run(self, documents):
+        # documents that were running during a crash are submitted again, their finished stages come from the caches
+        pending = sorted(((pdf, priority) for pdf, priority in documents
+                          if self.checkpoint.get(str(pdf), {}).get("status") != "done"), key=lambda d: d[1])
+        skipped = len(documents) - len(pending)
+        config = blobs.offload(self.config_dict, force=True)
+        running, task_ids, deadlines = {}, {}, {}
+        # one cursor per job stream, so every event is read exactly once
+        last_ids = {}
+        timeout = float(self.config_dict.get("JOBS", {}).get("running_timeout_hours") or 6) * 3600
+        start = checked = time.monotonic()
+
+        while pending or running:
+            while pending and len(running) < self.max_in_flight:
+                pdf, priority = pending.pop(0)
+                job = self.submit(pdf, priority, config)
+                if job["state"] == "done":
+                    print(f"done {pdf} (converted before)")
+                    continue
+                if job["job_id"] not in running:
+                    last_ids[job["job_id"]] = "0-0"
+                    task_ids[job["job_id"]] = job.get("task_ids", [])
+                    deadlines[job["job_id"]] = time.monotonic() + timeout
+                running.setdefault(job["job_id"], []).append((str(pdf), StageProgress(list(self.stages.keys()))))
+                print(f"submitted {pdf}")
+            if not running:
+                continue
+
+            for job_id, event in progress.read(last_ids):
+                for pdf, job in running[job_id]:
+                    job.update(event)
+                    self.record_event(pdf, event)
+
+            if time.monotonic() - checked > 5:
+                # revoked tasks and lost workers never publish their failure
+                checked = time.monotonic()
+                for job_id, entries in running.items():
+                    error = self.pipeline.failure(job_id, task_ids[job_id])
+                    if error is None and checked > deadlines[job_id]:
+                        error = "Timed out"
+                    if error is not None:
+                        for _, job in entries:
+                            job.fail(error)
+                        self.pipeline.abandon(job_id, entries[0][1].failed["stage"], error)
+
+            for job_id in [job_id for job_id, entries in running.items() if all(job.finished for _, job in entries)]:
+                for pdf, job in running.pop(job_id):
+                    self.checkpoint[pdf]["status"] = "failed" if job.failed is not None else "done"
+                    self.checkpoint[pdf]["finished"] = time.time()
+                    if job.failed is not None:
+                        self.checkpoint[pdf]["error"] = job.failed.get("error")
+                    print(f"{self.checkpoint[pdf]['status']} {pdf}")
+                del last_ids[job_id], task_ids[job_id], deadlines[job_id]
+                self.save_checkpoint()
+
+        report = self.report(documents, skipped, time.monotonic() - start)
+        (self.working_dir / "report.json").write_text(json.dumps(report, indent=1))
+        return report
+
+    def record_event(self, pdf, event):
+        if event["stage"] not in self.stages:
+            return
+        stage = self.checkpoint[pdf]["stages"].setdefault(event["stage"], {"start": event["time"], "end": None, "sections": None})
+        if event["total"] is not None:
+            stage["sections"] = event["total"]
+        if event["state"] == "SUCCESS":
+            stage["end"] = event["time"]
+
+    def report(self, documents, skipped, wall_seconds):
+        entries = [self.checkpoint[str(pdf)] for pdf, _ in documents if str(pdf) in self.checkpoint]
+        stages = {}
+        for name, label in self.stages.items():
+            finished = [e["stages"][name] for e in entries if e["stages"].get(name, {}).get("end") is not None]
+            busy = sum(s["end"] - s["start"] for s in finished)
+            sections = sum(s["sections"] or 0 for s in finished)
+            stages[name] = {"label": label, "documents": len(finished), "busy_seconds": busy,
+                            "seconds_per_document": busy / len(finished) if finished else None,
+                            "sections_per_second": sections / busy if busy > 0 else None}
+        return {"documents": len(documents), "skipped": skipped,
+                "done": sum(1 for e in entries if e["status"] == "done"),
+                "failed": [pdf for pdf, _ in documents if self.checkpoint.get(str(pdf), {}).get("status") == "failed"],
+                "wall_seconds": wall_seconds, "stages": stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts whole directories or lists of PDFs to audio without the Web App.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories of PDFs, or text files with one 'path [priority]' per line")
+    parser.add_argument("-o", "--output", default="data/batch", help="working dir that holds the outputs, checkpoint, and report")
+    parser.add_argument("-c", "--config", default="paper2go.ini", help="INI file with the conversion settings")
+    parser.add_argument("-j", "--max-in-flight", type=int, default=4, help="number of documents processed at the same time")
+    parser.add_argument("-p", "--priority", type=int, default=5, help="priority of documents without one, 0 is processed first")
+    args = parser.parse_args()
+
+    celery_app = Celery('tasks')
+    celery_app.config_from_object('celeryconfig')
+    runner = BatchRunner(celery_app, load_config(args.config), args.output, args.max_in_flight)
+    report = runner.run(find_documents(args.inputs, args.priority))
+
+    print(f"{report['done']}/{report['documents']} done ({report['skipped']} skipped), {len(report['failed'])} failed in {report['wall_seconds']:.0f} s")
+    for stage in report["stages"].values():
+        if stage["documents"] > 0:
+            rate = f", {stage['sections_per_second']:.2f} sections/s" if stage["sections_per_second"] else ""
+            print(f"  {stage['label']}: {stage['seconds_per_document']:.1f} s/document{rate}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import random
+import textwrap
+from pathlib import Path
+
+words = ("signal model latency throughput memory accuracy network layer sample error bound energy cache "
+         "pipeline dataset result method analysis system training inference hardware design measure").split()
+
+def sentence(rng):
+    return " ".join(rng.choice(words) for _ in range(rng.randint(8, 18))).capitalize() + "."
+
+def make_paper(rng, nr_sections, nr_paragraphs):
+    sections = [("Abstract", [" ".join(sentence(rng) for _ in range(5))])]
+    for i in range(1, nr_sections):
+        sections.append((f"{i} Section {rng.choice(words).capitalize()}",
+                         [" ".join(sentence(rng) for _ in range(rng.randint(3, 7))) for _ in range(nr_paragraphs)]))
+    return sections
+
+def escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path, title, sections):
+    """Writes a plain single-column PDF with Helvetica text, headings are set in bold and larger."""
+    lines = [("F2", 18, title), ("F1", 11, "")]
+    for heading, paragraphs in sections:
+        lines += [("F2", 14, heading)]
+        for paragraph in paragraphs:
+            lines += [("F1", 11, line) for line in textwrap.wrap(paragraph, 90)] + [("F1", 11, "")]
+
+    pages, per_page = [], 48
+    for start in range(0, len(lines), per_page):
+        content = ["BT", "72 770 Td"]
+        for font, size, text in lines[start:start + per_page]:
+            content += [f"/{font} {size} Tf", f"0 -{size + 4} Td", f"({escape(text)}) Tj"]
+        content.append("ET")
+        pages.append("\n".join(content).encode("latin-1", errors="replace"))
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (5 + 2 * i) for i in range(len(pages))) + b"] /Count %d >>" % len(pages),
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>"]
+    for i, content in enumerate(pages):
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>" % (6 + 2 * i))
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    data, offsets = b"%PDF-1.4\n", []
+    for nr, obj in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % nr + obj + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    Path(path).write_bytes(data)
+
+def make_corpus(odir, nr_docs=3, nr_sections=6, nr_paragraphs=3, seed=42):
+    """Generates the same fixture PDFs for the same arguments, so runs are comparable."""
+    rng = random.Random(seed)
+    Path(odir).mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(nr_docs):
+        files.append(Path(odir) / f"paper_{i}.pdf")
+        write_pdf(files[-1], f"Benchmark Paper {i}", make_paper(rng, nr_sections, nr_paragraphs))
+    return files
@@ -0,0 +1,194 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import argparse
+import io
+import configparser
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from bench.fixtures import make_corpus
+from bench.stubs import fake_ollama, fake_speech, synthetic_waveform
+import task.worker_config as worker_config
+
+stages = ["convert", "llm", "tts", "archive"]
+
+def write_bench_config(tmp, args):
+    # caches and blobs live in the temporary directory, so every run starts cold
+    parser = configparser.ConfigParser()
+    parser.read("paper2go_default.ini")
+    overrides = {"CACHE": {"enabled": "False", "dir": str(tmp / "cache")},
+                 "BLOBS": {"dir": str(tmp / "blobs")},
+                 "MANIFEST": {"dir": str(tmp / "jobs")},
+                 "WORKER": {"warmup": ""},
+                 "LISTENABLE": {"context_mode": args.context_mode, "max_in_flight": str(args.max_in_flight)},
+                 "TTS": {"max_parallel_sections": str(args.max_parallel_sections), "streaming": "False", "stream_chunks": "False"}}
+    for section, values in overrides.items():
+        if not parser.has_section(section):
+            parser.add_section(section)
+        for key, value in values.items():
+            parser.set(section, key, value)
+    with open(tmp / "bench.ini", "w") as f:
+        parser.write(f)
+    return tmp / "bench.ini", {section: dict(parser.items(section)) for section in parser.sections()}
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+def payload_size(value):
+    # the size in a JSON message, as Celery serializes them
+    return len(json.dumps(value).encode())
+
+def run(args):
+    tmp = Path(tempfile.mkdtemp(prefix="paper2go-bench-"))
+    ini, config_dict = write_bench_config(tmp, args)
+    worker_config.config_path = str(ini)
+    worker_config.load_worker_config.cache_clear()
+
+    # the task modules read the worker config on import
+    from task.archive import do_archive
+    from task.blob_store import blobs
+    from task.convert_mp3 import do_export_waveform
+    from task.convert_to_markdown import do_convert_to_markdown
+    from task.make_listenable import do_make_listenable
+    import task.make_tts as make_tts
+
+    ollama = fake_ollama(args.prefill_tps, args.generate_tps, args.llm_latency_ms / 1000)
+    config_dict["LISTENABLE"]["host"] = ollama.url
+    speech = None
+    if args.tts == "openai":
+        do_export_waveform(*synthetic_waveform()("x" * 15, config_dict), tmp / "speech.mp3")
+        speech = fake_speech((tmp / "speech.mp3").read_bytes(), args.tts_latency_ms / 1000)
+        config_dict["TTS"]["tts_method"] = "TTS_OPENAI"
+        config_dict["TTS_OPENAI"]["base_url"] = speech.url + "/v1"
+    else:
+        config_dict["TTS"]["tts_method"] = "TTS_XTTSv2"
+        make_tts.synthesize_waveform = synthetic_waveform(real_time_factor=args.real_time_factor)
+
+    latencies = {stage: [] for stage in stages}
+    section_latencies = []
+    payloads = {"offloaded": 0, "inline": 0}
+    nr_sections = 0
+    docling_init = 0.0
+    config_ref = blobs.offload(config_dict, force=True)
+
+    start = time.perf_counter()
+    for nr, pdf in enumerate(make_corpus(tmp / "corpus", args.docs, args.sections, args.paragraphs)):
+        pdf_bytes = pdf.read_bytes()
+        odir = tmp / "audio" / f"{nr}"
+        os.makedirs(odir)
+
+        t = time.perf_counter()
+        converted = do_convert_to_markdown(pdf_bytes)
+        latencies["convert"].append(time.perf_counter() - t)
+        docling_init += converted.get("init_seconds", 0.0)
+
+        t = time.perf_counter()
+        listenable = do_make_listenable(converted["markdown"], config_dict)
+        latencies["llm"].append(time.perf_counter() - t)
+
+        def lane(nrs):
+            # as the tts task does, each lane encodes a section while it synthesizes the next one
+            times, last = [], time.perf_counter()
+            def finished(nr):
+                nonlocal last
+                times.append(time.perf_counter() - last)
+                last = time.perf_counter()
+            make_tts.do_make_tts_lane([(i, listenable["titles"][i], listenable["script"][i]) for i in nrs], odir, config_dict,
+                                      on_section=finished)
+            return times
+
+        t = time.perf_counter()
+        lanes = make_tts.section_lanes(len(listenable["script"]), args.max_parallel_sections)
+        with ThreadPoolExecutor(max_workers=len(lanes)) as pool:
+            for times in pool.map(lane, lanes):
+                section_latencies += times
+        latencies["tts"].append(time.perf_counter() - t)
+        nr_sections += len(listenable["script"])
+
+        t = time.perf_counter()
+        archive = io.BytesIO()
+        do_archive(str(odir), archive)
+        latencies["archive"].append(time.perf_counter() - t)
+
+        # the messages Celery would carry between the stages, with and without the blob store,
+        # the PDF is always passed as a blob reference since JSON messages cannot carry bytes
+        messages = [converted["markdown"], listenable["script"], config_dict, config_dict]
+        pdf_ref = blobs.offload(pdf_bytes, force=True)
+        payloads["inline"] += payload_size(pdf_ref) + sum(payload_size(m) for m in messages)
+        payloads["offloaded"] += payload_size(pdf_ref) + sum(payload_size(blobs.offload(m)) for m in messages[:2]) + 2 * payload_size(config_ref)
+        print(f"{pdf.name}: {len(listenable['script'])} sections, archive {archive.tell() / 1024:.0f} KiB", file=sys.stderr)
+    wall = time.perf_counter() - start
+
+    ollama.close()
+    if speech is not None:
+        speech.close()
+
+    return {"docs": args.docs, "sections": nr_sections, "wall_seconds": wall,
+            "sections_per_second": nr_sections / wall,
+            "tts_sections_per_second": nr_sections / sum(latencies["tts"]),
+            "stages": {stage: {"p50": percentile(v, 0.5), "p90": percentile(v, 0.9), "p99": percentile(v, 0.99), "total": sum(v)}
+                       for stage, v in latencies.items()},
+            "tts_section": {"p50": percentile(section_latencies, 0.5), "p90": percentile(section_latencies, 0.9),
+                            "p99": percentile(section_latencies, 0.99)},
+            "docling_init_seconds": docling_init,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+            "payload_bytes": payloads,
+            "settings": vars(args)}
+
+def compare(result, baseline, tolerance):
+    """Prints the change against the baseline, returns False if a stage got slower than the tolerance allows."""
+    ok = True
+    rows = [(f"{stage} p50 [s]", result["stages"][stage]["p50"], baseline["stages"][stage]["p50"], True) for stage in stages]
+    rows += [("sections/s", result["sections_per_second"], baseline["sections_per_second"], False),
+             ("peak RSS [MB]", result["peak_rss_mb"], baseline["peak_rss_mb"], True),
+             ("payload [B]", result["payload_bytes"]["offloaded"], baseline["payload_bytes"]["offloaded"], True)]
+    for name, now, before, lower_is_better in rows:
+        if not before:
+            continue
+        change = (now - before) / before
+        regressed = change > tolerance if lower_is_better else change < -tolerance
+        ok &= not regressed
+        print(f"{name:>20}: {before:10.3f} -> {now:10.3f} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the whole pipeline on fixture PDFs against local stand-ins for Ollama and TTS.")
+    parser.add_argument("--docs", type=int, default=3)
+    parser.add_argument("--sections", type=int, default=6)
+    parser.add_argument("--paragraphs", type=int, default=3)
+    parser.add_argument("--tts", choices=["synthetic", "openai"], default="synthetic")
+    parser.add_argument("--real-time-factor", type=float, default=0.05, help="synthesis time per second of synthetic audio")
+    parser.add_argument("--tts-latency-ms", type=float, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=20)
+    parser.add_argument("--prefill-tps", type=float, default=2000, help="prompt tokens per second of the fake Ollama")
+    parser.add_argument("--generate-tps", type=float, default=200, help="generated tokens per second of the fake Ollama")
+    parser.add_argument("--context-mode", default="rewritten", choices=["rewritten", "source", "prefix"])
+    parser.add_argument("--max-in-flight", type=int, default=1)
+    parser.add_argument("--max-parallel-sections", type=int, default=1)
+    parser.add_argument("--save-baseline", help="write the result to this JSON file")
+    parser.add_argument("--compare", help="compare the result with this baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before --compare fails")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=1))
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(result, indent=1))
+    if args.compare and not compare(result, json.loads(Path(args.compare).read_text()), args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
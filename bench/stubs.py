@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """Runs a request handler on a free local port in a background thread."""
+
+    def __init__(self, handler):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+    def send(self, status, body, content_type="application/json"):
+        data = json.dumps(body).encode() if content_type == "application/json" else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def fake_ollama(prefill_tokens_per_second=2000.0, tokens_per_second=50.0, latency=0.0):
+    """Answers /api/generate and /api/chat with the last user text, the delay follows the prompt and answer lengths."""
+
+    class Handler(JsonHandler):
+        def do_POST(self):
+            request = self.read_json()
+            if self.path == "/api/generate":
+                prompt = (request.get("system") or "") + request.get("prompt", "")
+            elif self.path == "/api/chat":
+                prompt = "".join(m["content"] for m in request.get("messages", []))
+            else:
+                return self.send(404, {"error": "not found"})
+
+            # the answer is the last block delimited by triple backquotes, i.e., the text to rewrite
+            answer = prompt.rsplit("```", 2)[-2] if prompt.count("```") >= 2 else prompt[-2000:]
+            prompt_tokens, answer_tokens = len(prompt) // 4, len(answer) // 4
+            prefill, generate = prompt_tokens / prefill_tokens_per_second, answer_tokens / tokens_per_second
+            time.sleep(latency + prefill + generate)
+
+            body = {"model": request.get("model", "stub"), "created_at": datetime.now(timezone.utc).isoformat(), "done": True,
+                    "done_reason": "stop", "total_duration": int((latency + prefill + generate) * 1e9),
+                    "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prefill * 1e9),
+                    "eval_count": answer_tokens, "eval_duration": int(generate * 1e9)}
+            if self.path == "/api/generate":
+                body["response"] = answer
+            else:
+                body["message"] = {"role": "assistant", "content": answer}
+            self.send(200, body)
+
+    return StubServer(Handler)
+
+
+def fake_speech(mp3_bytes, latency=0.0, seconds_per_char=0.0):
+    """OpenAI compatible /v1/audio/speech endpoint that always returns the same MP3."""
+
+    class Handler(JsonHandler):
+        def do_POST(self):
+            if not self.path.endswith("/audio/speech"):
+                return self.send(404, {"error": "not found"})
+            request = self.read_json()
+            time.sleep(latency + seconds_per_char * len(request.get("input", "")))
+            self.send(200, mp3_bytes, content_type="audio/mpeg")
+
+    return StubServer(Handler)
+
+
+def synthetic_waveform(sample_rate=24000, chars_per_second=15.0, real_time_factor=0.0):
+    """Stands in for synthesize_waveform, returns a tone as long as the text would be spoken."""
+
+    def synthesize(text, config_dict, split_sentences=False):
+        import numpy as np
+        seconds = max(len(text) / chars_per_second, 0.1)
+        time.sleep(seconds * real_time_factor)
+        t = np.arange(int(seconds * sample_rate)) / sample_rate
+        return 0.2 * np.sin(2 * np.pi * 220 * t).astype(np.float32), sample_rate
+
+    return synthesize
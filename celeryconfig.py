@@ -0,0 +1,26 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+broker_url = 'redis://localhost:6379/0'
+result_backend = 'redis://localhost:6379/0'
+
+# lower numbers are consumed first, used by batch.py to prioritize documents
+broker_transport_options = {'priority_steps': list(range(10)), 'queue_order_strategy': 'priority'}
+
+task_routes = {
+    'tasks.convert_to_markdown': {'queue': 'convert'},
+    'tasks.make_listenable': {'queue': 'llm'},
+    'tasks.listenable_stage': {'queue': 'llm'},
+    'tasks.listenable_tts_stage': {'queue': 'llm'},
+    'tasks.make_tts': {'queue': 'tts'},
+    'tasks.tts_stage': {'queue': 'tts'},
+    'tasks.make_tts_section': {'queue': 'tts'},
+    'tasks.make_tts_lane': {'queue': 'tts'},
+    'tasks.collect_tts': {'queue': 'tts'},
+    'tasks.collect_streamed_tts': {'queue': 'tts'},
+    'tasks.make_audiobook': {'queue': 'tts'},
+    'tasks.finish_job': {'queue': 'convert'},
+    'tasks.encode_reference': {'queue': 'tts'},
+    'tasks.prepare_voice': {'queue': 'tts'},
+    'tasks.tts_status': {'queue': 'tts'},
+}
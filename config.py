@@ -35,6 +35,10 @@ class Config:
                        "TTS_OPENAI":  [slider_config_setup("TTS_OPENAI", "speed", "Speed", float, 0.5, 4.0)]
                      }
 
+    basic_checkboxes = [checkbox_config_setup("TTS", "streaming", "Synthesize sections while rewriting")]
+
+    basic_selectboxes = [selectbox_config_setup("OUTPUT", "format", "Download as", List[str], ["zip", "mp3", "m4b"])]
+
     config_checkboxes = { "TTS_FISH" :   [checkbox_config_setup("TTS_FISH", "compile", "Compile")],
                           "TTS_XTTSv2" : [checkbox_config_setup("TTS_XTTSv2", "split_sentences", "Split Sentence")]}
     
@@ -48,7 +52,12 @@ class Config:
 
     ollama_inputboxes = [input_config_setup("LISTENABLE", "model", "Ollama Model"),
                          input_config_setup("LISTENABLE", "host", "Ollama Host"),
-                         input_config_setup("LISTENABLE", "filters", "Sections to ignore")]
+                         input_config_setup("LISTENABLE", "filters", "Sections to ignore"),
+                         input_config_setup("LISTENABLE", "max_in_flight", "Parallel Requests")]
+
+    ollama_selectboxes = [selectbox_config_setup("LISTENABLE", "context_mode", "Context", List[str], ["rewritten", "source", "prefix"])]
+
+    ollama_checkboxes = [checkbox_config_setup("LISTENABLE", "regenerate", "Regenerate (ignore cached responses)")]
 
     ollama_inputareas = [input_config_setup("LISTENABLE", "system_prompt", "System Prompt"),
                          input_config_setup("LISTENABLE", "user_prompt_template", "User Prompt")]
@@ -56,7 +65,8 @@ class Config:
 
     def __init__(self, voices_dir:Path):
         self.voices_dir = voices_dir
-        self.celery_app = Celery('tasks', broker='redis://localhost:6379/0', backend='redis://localhost:6379/0')
+        self.celery_app = Celery('tasks')
+        self.celery_app.config_from_object('celeryconfig')
         ConfigIO.load_config()
 
     def as_dict(self):
@@ -80,6 +90,9 @@ class Config:
     def ollama_settings_prompts_dialog(self):
         st.caption("🚧 No check yet. Make sure the model is available.")
         ConfigHelper.make_text_inputs(self.ollama_inputboxes)
+        ConfigHelper.make_selectboxes(self.ollama_selectboxes)
+        st.caption("With context 'source', all sections but the first are rewritten in parallel using the original text of the previous section as context. Context 'prefix' sends the system prompt and the rewritten first section as an identical chat prefix, so Ollama can reuse its prompt cache. Match 'Parallel Requests' to OLLAMA_NUM_PARALLEL of your Ollama server.")
+        ConfigHelper.make_checkboxes(self.ollama_checkboxes)
         ConfigHelper.make_text_ares(self.ollama_inputareas)
 
     @st.dialog("Record your voice")
@@ -94,10 +107,7 @@ class Config:
             with open(self.voices_dir / (filename + ".txt"), 'w') as f:
                 f.write(transcript)
             
-            task_convert = self.__encode_reference(
-                str(self.voices_dir / (filename + ".wav")),
-                str(self.voices_dir / (filename + ".npy")),
-                self.as_dict())
+            task_convert = self.__prepare_voice(str(self.voices_dir / filename), self.as_dict())
             if task_convert is None:
                 st.error("Cannot convert.")
             st.success(f"Voice successfully saved as {filename}")
@@ -116,14 +126,15 @@ class Config:
                 os.remove(file_path)
         st.rerun()
 
-    def __encode_reference(self, ifile, ofile, config_dict):
-        return self.celery_app.send_task('tasks.encode_reference', args=[ifile, ofile, config_dict])
+    def __prepare_voice(self, voice, config_dict):
+        return self.celery_app.send_task('tasks.prepare_voice', args=[voice, config_dict])
 
 
     def update_voice_transcript(self, voice_selection):
         if os.path.isfile(self.voices_dir / (voice_selection + ".txt")):
             with open(self.voices_dir / (voice_selection + ".txt"), "w") as f:
                 f.write(st.session_state["voice_transcript_text"])
+            self.__prepare_voice(str(self.voices_dir / voice_selection), self.as_dict())
 
     def config_ui(self):
         with st.sidebar:
@@ -155,6 +166,8 @@ class Config:
                             args=["TTS/tts_method", Config.__tts_label_to_section]
                 )
                 st.markdown("OpenAI with local OpenedAI-Speech is fastest in default.")
+                ConfigHelper.make_checkboxes(Config.basic_checkboxes)
+                ConfigHelper.make_selectboxes(Config.basic_selectboxes)
 
             with st.expander("Voice Cloning"):
                 st.markdown("Only for Fish-Speech & XTTS")
@@ -162,12 +175,14 @@ class Config:
                                 label="Voice sample",
                                 type=["mp3", "wav"])
 
-                if tts_voice_upload is not None:
+                if tts_voice_upload is not None and not (os.path.isfile(self.voices_dir/tts_voice_upload.name) and
+                        (self.voices_dir/tts_voice_upload.name).read_bytes() == bytes(tts_voice_upload.getbuffer())):
                     with open(self.voices_dir/tts_voice_upload.name, "wb") as f:
                         f.write(tts_voice_upload.getbuffer())
                         if tts_voice_upload.type != "wav":
                             f = Path(self.voices_dir/tts_voice_upload).absolute()
                             AudioSegment.from_wav(f).export(f.with_suffix('.wav'), format="wav")
+                    self.__prepare_voice(str(self.voices_dir / Path(tts_voice_upload.name).stem), self.as_dict())
 
                 if "voice_record" not in st.session_state:
                     if st.button("🎤 Record Voice", use_container_width=True):
@@ -30,7 +30,7 @@ class ConfigHelper:
         for s in ctx_list:
             st.toggle(
                 label=s.label,
-                value=bool(st.session_state["config"][s.section][s.key]),
+                value=str(st.session_state["config"][s.section][s.key]) == "True",
                 key=f"{s.section}/{s.key}",
                 on_change=ConfigHelper.update_config,
                 args=[f"{s.section}/{s.key}"]
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+from celery import chain
+from celery.result import AsyncResult
+from task.blob_store import blobs
+from task.disk_cache import hash_bytes, hash_key
+from task.job_registry import jobs
+from task.manifest import tts_config
+from task.progress import progress
+from task.worker_config import worker_option
+
+audiobook_formats = ("mp3", "m4b")
+
+
+class PdfPipeline:
+    """Submits every PDF as one chain of convert -> llm -> tts stages, so the stages of different files overlap."""
+
+    stages = {"convert": "PDF to Text Conversion", "llm": "Reformulation", "tts": "Text-to-Speech"}
+
+    def __init__(self, celery_app):
+        self.celery_app = celery_app
+
+    def stages_for(self, output_format):
+        return dict(self.stages, book="Audiobook") if output_format in audiobook_formats else self.stages
+
+    def submit(self, file_bytes, working_dir, nr, config, job_id, streaming=False, output_format="zip", priority=None):
+        """Starts the pipeline unless the same PDF with the same config is already running or done, returns the job to follow."""
+        job = {"job_id": job_id, "working_dir": str(working_dir), "nr": str(nr), "state": "running"}
+        config_dict = blobs.resolve(config)
+        # a regeneration must not be answered with the results it is meant to replace
+        if worker_option("JOBS", "deduplicate", True, bool) and config_dict["LISTENABLE"].get("regenerate", "False") != "True":
+            pdf_hash = file_bytes["blob"] if blobs.is_ref(file_bytes) else hash_bytes(file_bytes)
+            # the voice is referenced by its path, its recording and transcript may change under the same name
+            config_hash = hash_key(config["blob"] if blobs.is_ref(config) else config, output_format, tts_config(config_dict))
+            job, created = jobs.claim(pdf_hash, config_hash, job)
+            if not created:
+                return dict(job, attached=True)
+
+        options = {"job_id": job_id}
+        signature = lambda name, args: self.celery_app.signature(name, args=args, kwargs=options, priority=priority)
+        convert = signature('tasks.convert_to_markdown', [file_bytes, str(working_dir / f"01_extracted_{nr}.md")])
+        if streaming:
+            stages = [
+                convert,
+                signature('tasks.listenable_tts_stage', [str(working_dir / "audio" / f"{nr}"), config, str(working_dir / f"02_script_{nr}.md")]),
+                signature('tasks.collect_streamed_tts', [])]
+        else:
+            stages = [
+                convert,
+                signature('tasks.listenable_stage', [config, str(working_dir / f"02_script_{nr}.md")]),
+                signature('tasks.tts_stage', [str(working_dir / "audio" / f"{nr}"), config])]
+        if output_format in audiobook_formats:
+            stages.append(signature('tasks.make_audiobook', [str(audiobook_file(working_dir, nr, output_format))]))
+        stages.append(signature('tasks.finish_job', []))
+        result = chain(*stages).apply_async()
+        jobs.started(job_id, chain_ids(result))
+        return dict(job, attached=False, task_ids=chain_ids(result))
+
+    def failure(self, job_id, task_ids=()):
+        """Returns why a job stopped if one of its tasks failed or was revoked without publishing it, or its worker is gone."""
+        for task_id in list(task_ids) or jobs.task_ids(job_id):
+            result = AsyncResult(task_id, app=self.celery_app)
+            if result.state in ("FAILURE", "REVOKED"):
+                return f"Task {result.state.lower()}: {result.info}"
+        if (hostname := jobs.lost_worker(job_id)) is not None:
+            return f"Worker {hostname} stopped responding"
+        return None
+
+    @staticmethod
+    def abandon(job_id, stage, error):
+        # tells everyone following the job, and lets the next submission start it again
+        progress.publish(job_id, stage, state="FAILURE", error=error)
+        jobs.finish(job_id, succeeded=False)
+
+def chain_ids(result):
+    ids = []
+    while result is not None:
+        ids.append(result.id)
+        result = result.parent
+    return ids
+
+def audiobook_file(working_dir, nr, output_format):
+    return working_dir / "books" / f"{nr}.{output_format}"
+
+def job_output(job, output_format):
+    working_dir = Path(job["working_dir"])
+    return audiobook_file(working_dir, job["nr"], output_format) if output_format in audiobook_formats else working_dir / "audio" / job["nr"]
+
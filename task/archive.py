@@ -3,13 +3,23 @@
 
 import os
 import zipfile
+from task.metrics import metrics
+
+# already compressed media does not shrink any further, it is only stored
+stored = (".mp3", ".opus", ".m4a", ".m4b", ".ogg")
 
 def do_archive(idir, ofile):
-    with zipfile.ZipFile(ofile, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(idir):
+    """Zips idir into ofile, a path or a file object such as io.BytesIO for an archive in memory."""
+    with metrics.span("archive"), zipfile.ZipFile(ofile, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for root, dirs, files in os.walk(idir, followlinks=True):
             rel_root = os.path.relpath(root, idir)
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
             
             for file in files:
                 full_file_path = os.path.join(root, file)
                 arcname = os.path.join(rel_root, file)
-                zipf.write(full_file_path, arcname=arcname)
+                compression = zipfile.ZIP_STORED if file.lower().endswith(stored) else zipfile.ZIP_DEFLATED
+                zipf.write(full_file_path, arcname=arcname, compress_type=compression)
+    size = ofile.tell() if hasattr(ofile, "tell") else os.path.getsize(ofile)
+    metrics.count("bytes", size, kind="archive")
+    return {"status": "complete", "bytes": size}
@@ -0,0 +1,50 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from task.metrics import metrics
+
+def probe_duration(file):
+    result = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(file)],
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip())
+
+def chapter_metadata(titles, durations):
+    def escape(text):
+        for c in "\\=;#\n":
+            text = text.replace(c, "\\" + c)
+        return text
+
+    lines = [";FFMETADATA1"]
+    start = 0
+    for title, duration in zip(titles, durations):
+        end = start + int(round(duration * 1000))
+        lines += ["[CHAPTER]", "TIMEBASE=1/1000", f"START={start}", f"END={end}", f"title={escape(title.strip().strip('#').strip())}"]
+        start = end
+    return "\n".join(lines) + "\n"
+
+def do_make_audiobook(files, titles, ofile):
+    """Concatenates the section files into one MP3 or M4B with a chapter per section."""
+    durations = [probe_duration(f) for f in files]
+    os.makedirs(Path(ofile).parent, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        concat_list, metadata = Path(tmp) / "sections.txt", Path(tmp) / "chapters.txt"
+        # the concat demuxer reads the sections one after another, nothing is decoded when the codec matches
+        concat_list.write_text("".join("file '{}'\n".format(str(Path(f).absolute()).replace("'", "'\\''")) for f in files))
+        metadata.write_text(chapter_metadata(titles, durations))
+
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", str(concat_list),
+               "-i", str(metadata), "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1"]
+        if Path(ofile).suffix == ".mp3":
+            cmd += ["-c", "copy", "-id3v2_version", "3"]
+        else:
+            cmd += ["-c:a", "aac", "-b:a", "64k", "-f", "mp4"]
+        part = f"{ofile}.part"
+        with metrics.span("audiobook", format=Path(ofile).suffix.lstrip(".")):
+            subprocess.run(cmd + [part], check=True)
+        os.replace(part, ofile)
+
+    return {"status": "complete", "file": str(ofile), "chapters": len(files), "duration": sum(durations)}
@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import json
+from task.disk_cache import DiskCache, hash_bytes
+from task.metrics import metrics
+from task.worker_config import worker_option
+
+
+class BlobStore:
+    """Shared directory for task payloads, so messages only carry content hashes instead of the data itself."""
+
+    def __init__(self, root, threshold, max_age=0):
+        self.cache = DiskCache(root, max_age=max_age)
+        self.threshold = threshold
+
+    def offload(self, value, force=False):
+        if value is None or self.is_ref(value):
+            return value
+        if isinstance(value, bytes):
+            kind, data = "bytes", value
+        elif isinstance(value, str):
+            kind, data = "str", value.encode()
+        else:
+            kind, data = "json", json.dumps(value).encode()
+
+        if not force and len(data) <= self.threshold:
+            return value
+        key = hash_bytes(data)
+        if self.cache.lookup(key) is None:
+            self.cache.put_bytes(key, data)
+            metrics.count("bytes", len(data), kind="blob_write")
+        return {"blob": key, "kind": kind}
+
+    def resolve(self, value):
+        if not self.is_ref(value):
+            return value
+        data = self.cache.get_bytes(value["blob"])
+        if data is None:
+            raise FileNotFoundError(f"Blob {value['blob']} is missing in {self.cache.root}")
+        metrics.count("bytes", len(data), kind="blob_read")
+        if value["kind"] == "bytes":
+            return data
+        if value["kind"] == "str":
+            return data.decode()
+        return json.loads(data)
+
+    @staticmethod
+    def is_ref(value):
+        return isinstance(value, dict) and set(value.keys()) == {"blob", "kind"}
+
+
+blobs = BlobStore(worker_option("BLOBS", "dir", "data/blobs"),
+                  threshold=worker_option("BLOBS", "inline_threshold_kb", 64, float) * 1024,
+                  max_age=worker_option("BLOBS", "max_age_days", 7, float) * 86400)
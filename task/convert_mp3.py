@@ -1,8 +1,46 @@
 # SPDX-FileCopyrightText: 2025 Meinhard Kissich
 # SPDX-License-Identifier: MIT
 
-from pydub import AudioSegment
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from task.metrics import metrics
+from task.worker_config import worker_option
+
+codecs = {
+    ".mp3": ["-c:a", "libmp3lame", "-q:a", "2"],
+    ".opus": ["-c:a", "libopus", "-b:a", "48k"],
+}
+
+encoder_pool = ThreadPoolExecutor(max_workers=worker_option("WORKER", "encode_threads", os.cpu_count() or 1, int))
+
+# MP3 frames without ID3 tag and Xing header, files in this format can be appended to each other
+raw_mp3 = ["-write_xing", "0", "-id3v2_version", "0"]
+
+def ffmpeg(input_args, ofile, pcm=None, output_args=None):
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"] + input_args
+    cmd += (output_args if output_args is not None else codecs.get(Path(ofile).suffix, [])) + [str(ofile)]
+    with metrics.span("encode", codec=Path(ofile).suffix.lstrip(".")):
+        subprocess.run(cmd, input=pcm, check=True)
+    metrics.count("bytes", os.path.getsize(ofile), kind="audio")
 
 def do_convert_mp3(ifile, ofile):
-    AudioSegment.from_wav(ifile).export(ofile, format="mp3")
-    return {"status": "complete"}
\ No newline at end of file
+    ffmpeg(["-i", str(ifile)], ofile)
+    return {"status": "complete"}
+
+def do_export_waveform(waveform, sample_rate, ofile, raw=False):
+    # raw PCM is piped straight into ffmpeg, no intermediate WAV
+    pcm = (np.clip(np.asarray(waveform, dtype=np.float32), -1.0, 1.0) * 32767).astype(np.int16)
+    ffmpeg(["-f", "s16le", "-ar", str(int(sample_rate)), "-ac", "1", "-i", "pipe:0"], ofile, pcm.tobytes(),
+           output_args=codecs[".mp3"] + raw_mp3 if raw else None)
+    return {"status": "complete"}
+
+def do_remux_mp3(ifile, ofile, raw=False):
+    # only the container is rewritten, e.g., a header with the length of all frames of appended raw MP3s
+    ffmpeg(["-f", "mp3", "-i", str(ifile)], ofile, output_args=["-c", "copy"] + (raw_mp3 if raw else []))
+    return {"status": "complete"}
+
+def encode_async(func, *args):
+    return encoder_pool.submit(metrics.bind(func), *args)
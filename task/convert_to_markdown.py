@@ -1,30 +1,80 @@
 # SPDX-FileCopyrightText: 2025 Meinhard Kissich
 # SPDX-License-Identifier: MIT
 
+import json
+import time
+from importlib.metadata import version
+from pathlib import Path
 from tempfile import NamedTemporaryFile
 from docling.datamodel.base_models import InputFormat
 from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
 from docling.document_converter import DocumentConverter, PdfFormatOption
 from docling.pipeline.standard_pdf_pipeline import StandardPdfPipeline
+from task.disk_cache import DiskCache, hash_bytes, hash_key
+from task.metrics import metrics
+from task.model_registry import ModelRegistry
+from task.worker_config import worker_option
+
+docling_cache = DiskCache(Path(worker_option("CACHE", "dir", "cache")) / "docling",
+                          max_bytes=worker_option("CACHE", "docling_max_mb", 0, float) * 2 ** 20,
+                          max_age=worker_option("CACHE", "docling_max_age_days", 0, float) * 86400)
+
+docling_registry = ModelRegistry(max_models=4, name="docling")
+default_pipeline = (True, TableFormerMode.ACCURATE)
+
+def converter_loader(do_table_structure, table_mode):
+    def load():
+        artifacts_path = StandardPdfPipeline.download_models_hf()
+        pipeline_options = PdfPipelineOptions(artifacts_path=artifacts_path, do_table_structure=do_table_structure)
+        pipeline_options.table_structure_options.mode = table_mode
+
+        doc_converter = DocumentConverter(
+            format_options={
+                InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+            }
+        )
+        doc_converter.initialize_pipeline(InputFormat.PDF)
+        return doc_converter
+    return load
+
+def do_warmup_docling():
+    docling_registry.warmup(default_pipeline, converter_loader(*default_pipeline))
+
+def conversion_key(pdf_hash, pipeline):
+    # other converter options or another Docling version give another markdown
+    return hash_key("docling", pdf_hash, version("docling"), pipeline)
 
 def do_convert_to_markdown(file_bytes, ofile=None):
-    artifacts_path = StandardPdfPipeline.download_models_hf()
-    pipeline_options = PdfPipelineOptions(artifacts_path=artifacts_path, do_table_structure=True)
-    pipeline_options.table_structure_options.mode = TableFormerMode.ACCURATE
+    pdf_hash = hash_bytes(file_bytes)
+    key = conversion_key(pdf_hash, default_pipeline)
+    metrics.count("bytes", len(file_bytes), kind="pdf")
+    use_cache = worker_option("CACHE", "enabled", True, bool)
+    if use_cache and (cached := docling_cache.get_bytes(key, ".md")) is not None:
+        markdown = cached.decode()
+        if ofile is not None:
+            with open(ofile, "w") as f:
+                f.write(markdown)
+        return {"status": "complete", "markdown": markdown, "pdf_hash": pdf_hash, "cached": True}
 
-    doc_converter = DocumentConverter(
-        format_options={
-            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-        }
-    )
+    start = time.perf_counter()
+    entry = docling_registry.get(default_pipeline, converter_loader(*default_pipeline))
+    init_seconds = time.perf_counter() - start
 
-    with NamedTemporaryFile(delete=True, suffix=".pdf") as temp_file:
+    with entry.lock, docling_registry.timed(), metrics.span("docling_convert"), NamedTemporaryFile(delete=True, suffix=".pdf") as temp_file:
         temp_file.write(file_bytes)
+        temp_file.flush()
         temp_file_path = temp_file.name
-        markdown = doc_converter.convert(temp_file_path).document.export_to_markdown()
+        document = entry.model.convert(temp_file_path).document
+        markdown = document.export_to_markdown()
+
+    if use_cache:
+        docling_cache.put_bytes(key, markdown.encode(), ".md")
+        if worker_option("CACHE", "docling_store_document", False, bool):
+            docling_cache.put_bytes(key, json.dumps(document.export_to_dict()).encode(), ".json")
 
     if ofile is not None:
         with open(ofile, "w") as f:
             f.write(markdown)
 
-    return {"status": "complete", "markdown": markdown}
\ No newline at end of file
+    return {"status": "complete", "markdown": markdown, "pdf_hash": pdf_hash, "cached": False,
+            "init_seconds": init_seconds, "timing": docling_registry.snapshot()}
\ No newline at end of file
@@ -0,0 +1,181 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import Future
+import numpy as np
+
+SynthesisJob = namedtuple("SynthesisJob", "job_id text voice lang speed split_sentences")
+Replica = namedtuple("Replica", "process core_set jobs")
+
+def available_memory_mb():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+def plan_replicas(cores, available_mb, replica_mb, threads_per_replica=0, max_replicas=0):
+    """Splits the cores into one core set per replica, as many replicas as fit into the memory."""
+    by_memory = max(1, int(available_mb // replica_mb)) if replica_mb > 0 else len(cores)
+    # more replicas with fewer threads scale better than one model with all threads
+    by_cores = max(1, len(cores) // threads_per_replica) if threads_per_replica > 0 else max(1, len(cores) // 2)
+    count = min(by_memory, by_cores, max_replicas if max_replicas > 0 else len(cores))
+    threads = threads_per_replica if threads_per_replica > 0 else max(1, len(cores) // count)
+    return [cores[i * threads:(i + 1) * threads] for i in range(count)]
+
+def replica_main(model, core_set, jobs, results):
+    os.sched_setaffinity(0, core_set)
+    import torch
+    torch.set_num_threads(len(core_set))
+    torch.set_num_interop_threads(1)
+    from TTS.api import TTS
+    from task.voice_registry import VoiceRegistry
+
+    tts = TTS(model).to("cpu")
+    xtts_model = tts.synthesizer.tts_model
+    voice_registry = VoiceRegistry()
+    results.put(("ready", os.getpid(), None, None))
+
+    while (job := jobs.get()) is not None:
+        try:
+            gpt_cond_latent, speaker_embedding = voice_registry.xtts_conditioning(job.voice, xtts_model)
+            if job.text is None:
+                # only the conditioning of a new voice is prepared
+                results.put(("done", os.getpid(), job.job_id, None))
+                continue
+            with torch.inference_mode():
+                output = xtts_model.inference(job.text, job.lang, gpt_cond_latent, speaker_embedding,
+                                              temperature=xtts_model.config.temperature,
+                                              length_penalty=xtts_model.config.length_penalty,
+                                              repetition_penalty=xtts_model.config.repetition_penalty,
+                                              top_k=xtts_model.config.top_k,
+                                              top_p=xtts_model.config.top_p,
+                                              speed=job.speed,
+                                              enable_text_splitting=job.split_sentences)
+            results.put(("done", os.getpid(), job.job_id, (np.asarray(output["wav"], dtype=np.float32), tts.synthesizer.output_sample_rate)))
+        except Exception as e:
+            results.put(("failed", os.getpid(), job.job_id, repr(e)))
+
+
+class CpuReplicas:
+    """XTTS replicas in their own processes pinned to disjoint core sets, each section is dispatched to an idle replica."""
+
+    def __init__(self, model, core_sets):
+        self.model = model
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.futures = {}
+        self.pending = deque()
+        self.replicas = {}
+        self.ready = set()
+        self.idle = deque()
+        self.running = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.closed = False
+        for core_set in core_sets:
+            self.__start(core_set)
+        self.thread = threading.Thread(target=self.__collect, daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def synthesize(self, text, voice, lang, speed=1.0, split_sentences=False):
+        return self.__submit(text, str(voice), lang, float(speed), split_sentences)
+
+    def prepare_voice(self, voice):
+        return self.__submit(None, str(voice), None, None, None)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            futures, self.futures = list(self.futures.values()), {}
+            self.pending.clear()
+            for replica in self.replicas.values():
+                replica.jobs.put(None)
+        self.results.put(None)
+        for future in futures:
+            future.set_exception(RuntimeError("XTTS replicas were unloaded"))
+
+    def __submit(self, *fields):
+        future = Future()
+        with self.lock:
+            if self.closed or not self.replicas:
+                future.set_exception(RuntimeError("No XTTS replica is running"))
+                return future
+            job = SynthesisJob(next(self.ids), *fields)
+            self.futures[job.job_id] = future
+            self.pending.append(job)
+            self.__dispatch()
+        return future
+
+    def __dispatch(self):
+        # the job is assigned before it is sent, so the job of a replica that dies is always known
+        while self.pending and self.idle:
+            pid, job = self.idle.popleft(), self.pending.popleft()
+            self.running[pid] = job.job_id
+            self.replicas[pid].jobs.put(job)
+
+    def __start(self, core_set):
+        jobs = self.context.Queue()
+        process = self.context.Process(target=replica_main, args=(self.model, core_set, jobs, self.results), daemon=True)
+        process.start()
+        self.replicas[process.pid] = Replica(process, core_set, jobs)
+
+    def __collect(self):
+        while True:
+            try:
+                message = self.results.get(timeout=1.0)
+            except queue.Empty:
+                self.__restart_dead()
+                continue
+            if message is None:
+                return
+            kind, pid, job_id, value = message
+            future = None
+            with self.lock:
+                if kind == "ready":
+                    self.ready.add(pid)
+                else:
+                    future = self.futures.pop(job_id, None)
+                    self.running.pop(pid, None)
+                if pid in self.replicas:
+                    self.idle.append(pid)
+                self.__dispatch()
+            if future is None:
+                continue
+            if kind == "done":
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(f"XTTS replica failed: {value}"))
+
+    def __restart_dead(self):
+        # a crashed replica (e.g., killed by the OOM killer) fails its section and is replaced,
+        # one that dies while loading is not, otherwise it would be restarted forever
+        failed = []
+        with self.lock:
+            for pid, replica in list(self.replicas.items()):
+                if self.closed or replica.process.is_alive():
+                    continue
+                del self.replicas[pid]
+                if pid in self.idle:
+                    self.idle.remove(pid)
+                if (future := self.futures.pop(self.running.pop(pid, None), None)) is not None:
+                    failed.append((future, f"XTTS replica {pid} exited with {replica.process.exitcode}"))
+                if pid in self.ready:
+                    self.ready.discard(pid)
+                    self.__start(replica.core_set)
+            if not self.replicas:
+                failed += [(self.futures.pop(job.job_id), "No XTTS replica is running") for job in self.pending]
+                self.pending.clear()
+        for future, error in failed:
+            future.set_exception(RuntimeError(error))
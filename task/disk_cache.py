@@ -0,0 +1,165 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from task.metrics import metrics
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def hash_key(*parts):
+    return hash_bytes(json.dumps(parts, sort_keys=True, default=str).encode())
+
+
+class CacheStats:
+    """Counts cache hits and misses, of a cache over the process lifetime or of a single task."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def count(self, hit):
+        with self.lock:
+            self.stats["hits" if hit else "misses"] += 1
+        return hit
+
+    def snapshot(self):
+        with self.lock:
+            requests = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, hit_rate=self.stats["hits"] / requests if requests else 0.0)
+
+
+class DiskCache:
+    """Content-addressed file cache in a (possibly shared) directory, evicting least recently used entries."""
+
+    def __init__(self, root, max_bytes=0, max_age=0, scan_interval=60):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.scan_interval = scan_interval
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+        # size as of the last scan plus what this process stored since, other workers are caught up by the next scan
+        self.estimate = None
+        self.scanned = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key, suffix=""):
+        return self.root / key[:2] / (key + suffix)
+
+    def lookup(self, key, suffix=""):
+        path = self.path(key, suffix)
+        try:
+            fresh = self.max_age <= 0 or time.time() - path.stat().st_mtime <= self.max_age
+        except FileNotFoundError:
+            return None
+        return path if fresh else None
+
+    def fetch(self, key, ofile, suffix=""):
+        try:
+            if (path := self.lookup(key, suffix)) is None:
+                return self.__count(False)
+            os.utime(path, (time.time(), path.stat().st_mtime))
+            # a copy, not a link, since writers of the output truncate it in place
+            fd, tmp = tempfile.mkstemp(dir=Path(ofile).parent, suffix=".tmp")
+            os.close(fd)
+            try:
+                shutil.copyfile(path, tmp)
+                os.replace(tmp, ofile)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        except FileNotFoundError:
+            # evicted by another worker after the lookup
+            return self.__count(False)
+        return self.__count(True)
+
+    def store(self, key, ifile, suffix=""):
+        path = self.path(key, suffix)
+        os.makedirs(path.parent, exist_ok=True)
+        # unique per process and thread, workers share the directory
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(ifile, tmp)
+        os.replace(tmp, path)
+        self.__stored(path.stat().st_size)
+
+    def get_bytes(self, key, suffix=""):
+        try:
+            if (path := self.lookup(key, suffix)) is None:
+                self.__count(False)
+                return None
+            os.utime(path, (time.time(), path.stat().st_mtime))
+            data = path.read_bytes()
+        except FileNotFoundError:
+            self.__count(False)
+            return None
+        self.__count(True)
+        return data
+
+    def put_bytes(self, key, data, suffix=""):
+        path = self.path(key, suffix)
+        os.makedirs(path.parent, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.__stored(len(data))
+
+    def __count(self, hit):
+        metrics.count("cache_lookups", cache=self.root.name, result="hit" if hit else "miss")
+        return self.stats.count(hit)
+
+    def __stored(self, size):
+        if self.max_bytes <= 0 and self.max_age <= 0:
+            return
+        with self.lock:
+            if self.estimate is not None:
+                self.estimate += size
+            due = self.estimate is None or time.monotonic() - self.scanned > self.scan_interval or \
+                  (self.max_bytes > 0 and self.estimate > self.max_bytes)
+        if due:
+            self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for path in self.root.glob("*/*"):
+            if path.name.endswith(".tmp"):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if self.max_age > 0 and now - st.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((st.st_atime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if self.max_bytes > 0:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+        with self.lock:
+            self.estimate, self.scanned = total, time.monotonic()
+
+    def snapshot(self):
+        return self.stats.snapshot()
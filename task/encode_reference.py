@@ -4,12 +4,19 @@
 import os
 import subprocess
 from pathlib import Path
+import numpy as np
+from task.fish_engine import fish_engine_enabled, get_fish_engine
 
 
 def do_encode_reference(ifile, ofile, config_dict):
     import locale
     locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
 
+    if fish_engine_enabled(config_dict):
+        with get_fish_engine(config_dict) as engine:
+            np.save(ofile, engine.encode_reference(ifile).result())
+        return {"status": "complete"}
+
     cmd = ['python', str(Path(config_dict["TTS_FISH"]["inference_py"]).absolute())]
     cmd += ['-i', ifile]
     cmd += ['--checkpoint-path', str(Path(config_dict["TTS_FISH"]["generator_pth"]).absolute())]
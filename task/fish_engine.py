@@ -0,0 +1,141 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+import torch
+from task.model_registry import tts_registry, tts_device
+
+
+class FishEngine:
+    """Keeps the Fish-Speech LLaMA and VQGAN models loaded (and compiled) and serves requests from a queue."""
+
+    def __init__(self, config_dict, device):
+        fish_root = Path(config_dict["TTS_FISH"]["generate_py"]).absolute().parents[2]
+        if str(fish_root) not in sys.path:
+            sys.path.insert(0, str(fish_root))
+
+        from tools.llama.generate import GenerateRequest, launch_thread_safe_queue
+        from tools.vqgan.inference import load_model
+
+        self.GenerateRequest = GenerateRequest
+        self.device = device
+        self.compile = config_dict["TTS_FISH"]["compile"] == "True"
+        self.llama_queue = launch_thread_safe_queue(
+            checkpoint_path=str(Path(config_dict["TTS_FISH"]["fishspeech_chkp_path"]).absolute()),
+            device=device,
+            precision=torch.bfloat16,
+            compile=self.compile)
+        self.decoder = load_model(
+            config_name="firefly_gan_vq",
+            checkpoint_path=str(Path(config_dict["TTS_FISH"]["generator_pth"]).absolute()),
+            device=device)
+        self.sample_rate = self.decoder.spec_transform.sample_rate
+
+        self.requests = queue.Queue()
+        self.closed = False
+        self.closing = threading.Lock()
+        self.thread = threading.Thread(target=self.__serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def synthesize(self, text, params, prompt_text=None, prompt_tokens=None):
+        return self.__submit(self.__synthesize, text, params, prompt_text, prompt_tokens)
+
+    def encode_reference(self, wav_file):
+        return self.__submit(self.__encode_reference, wav_file)
+
+    def close(self):
+        # requests queued before the shutdown are still served, later ones fail right away
+        with self.closing:
+            self.closed = True
+            self.requests.put(None)
+
+    def __submit(self, func, *args):
+        future = Future()
+        with self.closing:
+            if self.closed:
+                future.set_exception(RuntimeError("Fish-Speech engine was unloaded"))
+            else:
+                self.requests.put((func, args, future))
+        return future
+
+    def __serve(self):
+        while (item := self.requests.get()) is not None:
+            func, args, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        self.llama_queue.put(None)
+
+    def __synthesize(self, text, params, prompt_text, prompt_tokens):
+        torch.manual_seed(int(params["seed"]))
+        if torch.cuda.is_available():
+            torch.cuda.manual_seed(int(params["seed"]))
+
+        response_queue = queue.Queue()
+        self.llama_queue.put(self.GenerateRequest(
+            request=dict(
+                device=self.device,
+                max_new_tokens=0,
+                text=text,
+                num_samples=1,
+                top_p=float(params["top_p"]),
+                repetition_penalty=float(params["repetition_penalty"]),
+                temperature=float(params["temperature"]),
+                compile=self.compile,
+                iterative_prompt=True,
+                chunk_length=int(params["chunk_length"]),
+                prompt_text=[prompt_text] if prompt_text is not None else None,
+                prompt_tokens=[torch.tensor(prompt_tokens).to(self.device)] if prompt_tokens is not None else None),
+            response_queue=response_queue))
+
+        codes = []
+        while True:
+            wrapped = response_queue.get()
+            if wrapped.status == "error":
+                raise wrapped.response
+            if wrapped.response.action == "next":
+                break
+            codes.append(wrapped.response.codes)
+
+        return self.decode(torch.cat(codes, dim=1)), self.sample_rate
+
+    def decode(self, codes):
+        indices = codes.to(self.device).long()
+        feature_lengths = torch.tensor([indices.shape[1]], device=self.device)
+        with torch.no_grad():
+            fake_audios, _ = self.decoder.decode(indices=indices[None], feature_lengths=feature_lengths)
+        return fake_audios[0, 0].float().cpu().numpy()
+
+    def __encode_reference(self, wav_file):
+        import torchaudio
+        audio, sr = torchaudio.load(str(wav_file))
+        if audio.shape[0] > 1:
+            audio = audio.mean(0, keepdim=True)
+        audio = torchaudio.functional.resample(audio, sr, self.sample_rate)
+        audios = audio[None].to(self.device)
+        audio_lengths = torch.tensor([audios.shape[2]], device=self.device, dtype=torch.long)
+        with torch.no_grad():
+            indices = self.decoder.encode(audios, audio_lengths)[0][0]
+        return indices.cpu().numpy()
+
+
+def get_fish_engine(config_dict):
+    """Context manager that keeps the engine loaded until the requests submitted inside it have completed."""
+    device = tts_device()
+    key = ("fish-speech", config_dict["TTS_FISH"]["fishspeech_chkp_path"], config_dict["TTS_FISH"]["generator_pth"],
+           config_dict["TTS_FISH"]["compile"], device)
+    return tts_registry.hold(key, lambda: FishEngine(config_dict, device))
+
+def fish_engine_enabled(config_dict):
+    return config_dict["TTS_FISH"].get("engine", "persistent") == "persistent"
@@ -0,0 +1,114 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import json
+import threading
+import time
+from pathlib import Path
+import redis
+import celeryconfig
+from task.worker_config import worker_option
+
+
+class JobRegistry:
+    """Maps (PDF hash, config hash) to the job producing its audio in Redis, so identical submissions share one pipeline."""
+
+    def __init__(self, url=celeryconfig.broker_url, running_timeout=6 * 3600, retention=24 * 3600):
+        self.redis = redis.Redis.from_url(url)
+        self.running_timeout = int(running_timeout)
+        self.retention = int(retention)
+
+    @staticmethod
+    def key(pdf_hash, config_hash):
+        return f"paper2go:jobs:{pdf_hash}:{config_hash}"
+
+    @staticmethod
+    def owner(job_id):
+        return f"paper2go:job-key:{job_id}"
+
+    @staticmethod
+    def worker(hostname):
+        return f"paper2go:worker:{hostname}"
+
+    @staticmethod
+    def running(job_id):
+        return f"paper2go:running:{job_id}"
+
+    def lookup(self, pdf_hash, config_hash):
+        entry = self.redis.get(self.key(pdf_hash, config_hash))
+        return json.loads(entry) if entry is not None else None
+
+    def claim(self, pdf_hash, config_hash, job):
+        """Registers the job unless the key is taken, returns the registered job and whether it is the given one."""
+        key = self.key(pdf_hash, config_hash)
+        entry = dict(job, state="running", submitted=time.time())
+        while True:
+            # SET NX decides between concurrent submissions, exactly one of them starts the pipeline
+            if self.redis.set(key, json.dumps(entry), nx=True, ex=self.running_timeout):
+                self.redis.set(self.owner(job["job_id"]), key, ex=self.running_timeout)
+                return entry, True
+            existing = self.lookup(pdf_hash, config_hash)
+            if existing is None:
+                continue
+            if existing["state"] == "done" and not Path(existing["working_dir"]).exists():
+                # the results were deleted, the key is stale
+                self.redis.delete(key)
+                continue
+            return existing, False
+
+    def started(self, job_id, task_ids):
+        """Adds the task ids of the started pipeline to the entry, so duplicate submissions can check them too."""
+        key = self.redis.get(self.owner(job_id))
+        entry = self.redis.get(key) if key is not None else None
+        if entry is not None and json.loads(entry)["job_id"] == job_id:
+            self.redis.set(key, json.dumps(dict(json.loads(entry), task_ids=task_ids)), keepttl=True)
+
+    def task_ids(self, job_id):
+        key = self.redis.get(self.owner(job_id))
+        entry = self.redis.get(key) if key is not None else None
+        return json.loads(entry).get("task_ids", []) if entry is not None else []
+
+    def heartbeat(self, hostname, interval=10.0):
+        """Refreshes the liveness key of a worker from a daemon thread, it expires a few intervals after the worker died."""
+        def beat():
+            while True:
+                try:
+                    self.redis.set(self.worker(hostname), time.time(), ex=int(3 * interval))
+                except redis.RedisError:
+                    pass
+                time.sleep(interval)
+        self.redis.set(self.worker(hostname), time.time(), ex=int(3 * interval))
+        threading.Thread(target=beat, daemon=True).start()
+
+    def task_started(self, job_id, task_id, hostname):
+        pipe = self.redis.pipeline()
+        pipe.hset(self.running(job_id), task_id, hostname)
+        pipe.expire(self.running(job_id), self.running_timeout)
+        pipe.execute()
+
+    def task_finished(self, job_id, task_id):
+        self.redis.hdel(self.running(job_id), task_id)
+
+    def lost_worker(self, job_id):
+        """Returns the worker running a task of the job if it stopped sending heartbeats, e.g., after it was killed."""
+        for hostname in set(self.redis.hvals(self.running(job_id))):
+            if not self.redis.exists(self.worker(hostname.decode())):
+                return hostname.decode()
+        return None
+
+    def finish(self, job_id, succeeded):
+        """Keeps a successful job addressable for the retention period, a failed one is released so it can be submitted again."""
+        key = self.redis.get(self.owner(job_id))
+        if key is None:
+            return
+        entry = self.redis.get(key)
+        if entry is not None and json.loads(entry)["job_id"] == job_id:
+            if succeeded:
+                self.redis.set(key, json.dumps(dict(json.loads(entry), state="done", finished=time.time())), ex=self.retention)
+            else:
+                self.redis.delete(key)
+        self.redis.delete(self.owner(job_id))
+
+
+jobs = JobRegistry(running_timeout=worker_option("JOBS", "running_timeout_hours", 6, float) * 3600,
+                   retention=worker_option("JOBS", "retention_hours", 24, float) * 3600)
@@ -2,13 +2,24 @@
 # SPDX-License-Identifier: MIT
 
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 from tqdm import tqdm
 import configparser
 import torch
 from ollama import chat, Client
 from ollama import ChatResponse
+from task.disk_cache import CacheStats, DiskCache, hash_key
+from task.metrics import metrics
+from task.token_budget import budget_sections, count_tokens
+from task.worker_config import worker_option
 
-def do_make_listenable(markdown, config_dict, ofile=None):
+llm_cache = DiskCache(Path(worker_option("CACHE", "dir", "cache")) / "llm",
+                      max_bytes=worker_option("CACHE", "llm_max_mb", 0, float) * 2 ** 20,
+                      max_age=worker_option("CACHE", "llm_max_age_days", 0, float) * 86400)
+
+def split_sections(markdown, config_dict):
     markdown_sections = re.split("(^#.*$)", markdown, flags=re.MULTILINE)
 
     to_skip = 0
@@ -30,33 +41,138 @@ def do_make_listenable(markdown, config_dict, ofile=None):
         if not s.startswith("#"):
             texts[-1] += s
             continue
-        
+
         print(s)
         processed_titles.append(s)
         texts.append(s)
 
+    return processed_titles, texts
+
+def regenerate(config_dict):
+    return config_dict["LISTENABLE"].get("regenerate", "False") == "True"
+
+def prefix_messages(config_dict, summary):
+    # byte-identical for all sections of a paper, so Ollama reuses the KV cache of this prefix
+    return [{"role": "system", "content": config_dict["LISTENABLE"]["system_prompt"]},
+            {"role": "user", "content": f"This is the summary of the paper all following texts are taken from.\n\n```{summary}```"},
+            {"role": "assistant", "content": "Understood."}]
+
+class EvalStats:
+    """Sums up the prompt evaluation (prefill) and generation times reported by Ollama."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "prompt_eval_count": 0, "prompt_eval_seconds": 0.0, "eval_count": 0, "eval_seconds": 0.0}
+        self.prompt_tokens = {}
+
+    def add(self, response, nr=None):
+        with self.lock:
+            if nr is not None:
+                self.prompt_tokens[nr] = response.prompt_eval_count
+            self.stats["requests"] += 1
+            self.stats["prompt_eval_count"] += response.prompt_eval_count or 0
+            self.stats["prompt_eval_seconds"] += (response.prompt_eval_duration or 0) / 1e9
+            self.stats["eval_count"] += response.eval_count or 0
+            self.stats["eval_seconds"] += (response.eval_duration or 0) / 1e9
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+def rewrite_section(client, config_dict, text, context, summary=None, stats=None, cache_stats=None, nr=None):
+    model = config_dict["LISTENABLE"]["model"]
+    system = config_dict["LISTENABLE"]["system_prompt"]
+    prompt = config_dict["LISTENABLE"]["user_prompt_template"].format(text=text, context=context)
+    keep_alive = config_dict["LISTENABLE"].get("keep_alive", "5m")
+
+    use_cache = worker_option("CACHE", "enabled", True, bool)
+    key = hash_key("llm", model, system, prompt) if summary is None else hash_key("llm", model, prefix_messages(config_dict, summary), prompt)
+    if use_cache and not regenerate(config_dict):
+        cached = llm_cache.get_bytes(key, ".txt")
+        if cache_stats is not None:
+            cache_stats.count(cached is not None)
+        if cached is not None:
+            return cached.decode()
+
+    with metrics.span("llm_generate"):
+        if summary is None:
+            response = client.generate(model=model, system=system, prompt=prompt, keep_alive=keep_alive)
+            rewritten = response.response
+        else:
+            response = client.chat(model=model, messages=prefix_messages(config_dict, summary) + [{"role": "user", "content": prompt}],
+                                   keep_alive=keep_alive)
+            rewritten = response.message.content
+    metrics.observe("llm_prompt_eval", (response.prompt_eval_duration or 0) / 1e9)
+    metrics.observe("llm_eval", (response.eval_duration or 0) / 1e9)
+    if stats is not None:
+        stats.add(response, nr)
+    rewritten = rewritten.strip().strip("```").strip().strip('"')
+    if use_cache:
+        llm_cache.put_bytes(key, rewritten.encode(), ".txt")
+    return rewritten
+
+def do_make_listenable(markdown, config_dict, ofile=None, on_section=None, manifest=None):
+    processed_titles, texts = budget_sections(*split_sections(markdown, config_dict), config_dict)
+
     processed_texts = []
 
     client = Client(host=config_dict["LISTENABLE"]["host"])
+    stats = EvalStats()
+    # the cache object counts over the worker lifetime, the result reports this call only
+    cache_stats = CacheStats()
 
-    for i in tqdm(range(len(texts))):
-        if len(processed_texts) == 0:
-            context = ""
-        elif len(processed_texts) == 1:
-            context = processed_texts[0]
-        else:
-            context = processed_texts[0] + processed_texts[-1]
+    def finished(i, text):
+        if on_section is not None:
+            on_section(i, processed_titles[i], text, len(texts))
+        return text
+
+    def rewrite(i, context, summary=None):
+        # sections whose text, context, and prompts did not change since the last run are reused
+        inputs = context if summary is None else summary + context
+        if manifest is not None and not regenerate(config_dict) and (script := manifest.find_rewrite(texts[i], inputs, config_dict)) is not None:
+            manifest.record_rewrite(i, processed_titles[i], texts[i], inputs, config_dict, script, reused=True)
+            return script
+        script = rewrite_section(client, config_dict, texts[i], context, summary, stats, cache_stats, nr=i)
+        if manifest is not None:
+            manifest.record_rewrite(i, processed_titles[i], texts[i], inputs, config_dict, script, reused=False)
+        return script
+
+    context_mode = config_dict["LISTENABLE"].get("context_mode", "rewritten")
+    if context_mode in ["source", "prefix"] and len(texts) > 1:
+        # context is the rewritten first section and the original predecessor,
+        # thus all sections but the first are independent of each other
+        processed_texts = [finished(0, rewrite(0, ""))] + [None] * (len(texts) - 1)
+
+        def rewrite_from_source(i):
+            if context_mode == "prefix":
+                # the summary goes into the stable prefix, only the predecessor follows it
+                return rewrite(i, texts[i-1] if i > 1 else "", summary=processed_texts[0])
+            return rewrite(i, processed_texts[0] + (texts[i-1] if i > 1 else ""))
+
+        with ThreadPoolExecutor(max_workers=int(config_dict["LISTENABLE"].get("max_in_flight", 1))) as pool:
+            futures = {pool.submit(metrics.bind(rewrite_from_source), i): i for i in range(1, len(texts))}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                processed_texts[futures[future]] = finished(futures[future], future.result())
+    else:
+        for i in tqdm(range(len(texts))):
+            if len(processed_texts) == 0:
+                context = ""
+            elif len(processed_texts) == 1:
+                context = processed_texts[0]
+            else:
+                context = processed_texts[0] + processed_texts[-1]
+
+            processed_texts.append(finished(i, rewrite(i, context)))
 
-        response = client.generate(
-            model=config_dict["LISTENABLE"]["model"],
-            system=config_dict["LISTENABLE"]["system_prompt"],
-            prompt=config_dict["LISTENABLE"]["user_prompt_template"].format(text=texts[i], context=context)
-        )
-        processed_texts.append(response.response.strip().strip("```").strip().strip('"'))
-    
 
     if ofile is not None:
         with open(ofile, "w") as f:
             f.write(' '.join(processed_texts))
-    
-    return {"status": "complete", "titles": processed_titles, "script": processed_texts}
\ No newline at end of file
+
+    result = {"status": "complete", "titles": processed_titles, "script": processed_texts, "cache": cache_stats.snapshot(),
+              "tokens": [count_tokens(text, config_dict) for text in texts], "ollama": stats.snapshot(),
+              # as evaluated by Ollama, None for sections taken from a cache
+              "prompt_tokens": [stats.prompt_tokens.get(i) for i in range(len(texts))]}
+    if manifest is not None:
+        result["reuse"] = manifest.summary()["llm"]
+    return result
@@ -2,102 +2,330 @@
 # SPDX-License-Identifier: MIT
 
 import os
+import re
 import configparser
 import subprocess
-from multiprocessing import Pool, Manager
 import random
+import time
 import shutil
-from pydub import AudioSegment
+import numpy as np
 from TTS.api import TTS
-import torch
 from pathlib import Path
+from task.model_registry import tts_registry, tts_device
+from task.fish_engine import fish_engine_enabled, get_fish_engine
+from task.xtts_batch import BatchedXtts
+from task.cpu_replicas import CpuReplicas, available_memory_mb, plan_replicas
+from task.voice_registry import VoiceRegistry
+from task.encode_reference import do_encode_reference
+from task.convert_mp3 import do_convert_mp3, do_export_waveform, do_remux_mp3, encode_async
+from task.disk_cache import DiskCache, hash_key
+from task.manifest import tts_config
+from task.metrics import metrics
+from task.worker_config import load_worker_config, worker_option
+
+voice_registry = VoiceRegistry()
+
+tts_cache = DiskCache(Path(worker_option("CACHE", "dir", "cache")) / "tts",
+                      max_bytes=worker_option("CACHE", "tts_max_mb", 0, float) * 2 ** 20)
+
+def xtts_loader(model, device):
+    return lambda: TTS(model).to(device)
+
+def xtts_batching():
+    return worker_option("WORKER", "xtts_batching", False, bool)
+
+def get_batched_xtts(model, device):
+    loader = lambda: BatchedXtts(TTS(model).to(device),
+                                 max_batch_size=worker_option("WORKER", "xtts_max_batch_size", 8, int),
+                                 max_wait=worker_option("WORKER", "xtts_max_batch_wait_ms", 50, float) / 1000)
+    return tts_registry.hold(("xtts-batched", model, device), loader)
+
+def cpu_replicas_enabled(device):
+    return device == "cpu" and worker_option("WORKER", "cpu_replicas", "0") != "0"
+
+def get_cpu_replicas(model):
+    def loader():
+        count = worker_option("WORKER", "cpu_replicas", "auto")
+        core_sets = plan_replicas(sorted(os.sched_getaffinity(0)), available_memory_mb(),
+                                  replica_mb=worker_option("WORKER", "cpu_replica_mb", 2500, float),
+                                  threads_per_replica=worker_option("WORKER", "cpu_threads_per_replica", 0, int),
+                                  max_replicas=0 if count == "auto" else int(count))
+        return CpuReplicas(model, core_sets)
+    return tts_registry.hold(("xtts-cpu-replicas", model), loader)
+
+def do_warmup(tts_methods):
+    for tts_method in tts_methods:
+        if tts_method == 'TTS_XTTSv2':
+            model = worker_option("TTS_XTTSv2", "model")
+            if cpu_replicas_enabled(tts_device()):
+                with get_cpu_replicas(model):
+                    pass
+            elif xtts_batching():
+                with get_batched_xtts(model, tts_device()):
+                    pass
+            else:
+                tts_registry.warmup((model, tts_device()), xtts_loader(model, tts_device()))
+        elif tts_method == 'TTS_FISH':
+            with get_fish_engine(load_worker_config()):
+                pass
+
+def do_tts_status():
+    engines = [e.model for e in list(tts_registry.entries.values()) if hasattr(e.model, "queue_depth")]
+    return {"status": "complete", "timing": tts_registry.snapshot(), "queue_depth": sum(e.queue_depth for e in engines),
+            "cache": tts_cache.snapshot()}
+
+def synthesis_key(text, config_dict):
+    return hash_key("tts", text, *tts_config(config_dict))
+
+def xtts_voice(config_dict):
+    return Path(config_dict["TTS"]["voice"]).absolute() if config_dict["TTS"]["voice"].split("/")[-1] != "Default" \
+                else Path(config_dict["TTS_XTTSv2"]["default_voice"]).absolute().with_suffix("")
+
+def fish_encoder(config_dict):
+    return lambda wav, ofile: do_encode_reference(wav, str(ofile), config_dict)
+
+def fish_prompt(config_dict):
+    if os.path.isfile(config_dict["TTS"]["voice"] + ".txt") and os.path.isfile(config_dict["TTS"]["voice"] + ".wav"):
+        with open(config_dict["TTS"]["voice"] + ".txt", "r") as f:
+            return ' '.join(f.readlines()), voice_registry.fish_prompt_tokens(config_dict["TTS"]["voice"], fish_encoder(config_dict))
+    return None, None
+
+def do_prepare_voice(voice, config_dict):
+    engines = [m.strip() for m in worker_option("WORKER", "voice_engines", "TTS_XTTSv2,TTS_FISH").split(",")]
+    if "TTS_XTTSv2" in engines:
+        # the conditioning is computed by the engine that synthesizes, instead of loading another model
+        device, model = tts_device(), config_dict["TTS_XTTSv2"]["model"]
+        if cpu_replicas_enabled(device):
+            with get_cpu_replicas(model) as replicas:
+                replicas.prepare_voice(voice).result()
+            voice_registry.remove_stale(voice)
+        elif xtts_batching():
+            with get_batched_xtts(model, device) as engine:
+                voice_registry.prepare(voice, ["TTS_XTTSv2"], xtts_model=engine.model)
+        else:
+            with tts_registry.use((model, device), xtts_loader(model, device)) as tts:
+                voice_registry.prepare(voice, ["TTS_XTTSv2"], xtts_model=tts.synthesizer.tts_model)
+    if "TTS_FISH" in engines and os.path.isfile(voice + ".txt"):
+        voice_registry.prepare(voice, ["TTS_FISH"], encode_fish=fish_encoder(config_dict))
+    return {"status": "complete"}
+
+def openai_speech(text, config_dict, ofile):
+    import openai
+    client = openai.OpenAI(
+        api_key=config_dict["TTS_OPENAI"]["api_key"],
+        base_url=config_dict["TTS_OPENAI"]["base_url"]
+    )
+
+    with client.audio.speech.with_streaming_response.create(
+        model=config_dict["TTS_OPENAI"]["model"],
+        voice=config_dict["TTS_OPENAI"]["voice"],
+        speed=config_dict["TTS_OPENAI"]["speed"],
+        response_format="mp3",
+        input=text,
+    ) as response:
+        response.stream_to_file(ofile)
+
+def synthesize_waveform(text, config_dict, split_sentences=False):
+    if config_dict["TTS"]["tts_method"] == 'TTS_FISH':
+        prompt_text, prompt_tokens = fish_prompt(config_dict)
+        with get_fish_engine(config_dict) as engine:
+            return engine.synthesize(text, config_dict["TTS_FISH"], prompt_text, prompt_tokens).result()
+
+    device = tts_device()
+    model = config_dict["TTS_XTTSv2"]["model"]
+    if cpu_replicas_enabled(device):
+        with get_cpu_replicas(model) as replicas:
+            return replicas.synthesize(text, xtts_voice(config_dict), config_dict["TTS_XTTSv2"]["lang"],
+                                       speed=config_dict["TTS_XTTSv2"]["speed"], split_sentences=split_sentences).result()
+    if xtts_batching():
+        with get_batched_xtts(model, device) as engine:
+            waveform = engine.synthesize(text,
+                                         voice_registry.xtts_conditioning(xtts_voice(config_dict), engine.model),
+                                         config_dict["TTS_XTTSv2"]["lang"],
+                                         speed=float(config_dict["TTS_XTTSv2"]["speed"]))
+        return waveform, engine.sample_rate
+
+    with tts_registry.use((model, device), xtts_loader(model, device)) as tts:
+        xtts_model = tts.synthesizer.tts_model
+        gpt_cond_latent, speaker_embedding = voice_registry.xtts_conditioning(xtts_voice(config_dict), xtts_model)
+        output = xtts_model.inference(text,
+                                      config_dict["TTS_XTTSv2"]["lang"],
+                                      gpt_cond_latent,
+                                      speaker_embedding,
+                                      temperature=xtts_model.config.temperature,
+                                      length_penalty=xtts_model.config.length_penalty,
+                                      repetition_penalty=xtts_model.config.repetition_penalty,
+                                      top_k=xtts_model.config.top_k,
+                                      top_p=xtts_model.config.top_p,
+                                      speed=float(config_dict["TTS_XTTSv2"]["speed"]),
+                                      enable_text_splitting=split_sentences)
+        return np.asarray(output["wav"]), tts.synthesizer.output_sample_rate
+
+def split_chunks(text, max_chars):
+    chunks = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        if len(chunks) > 0 and len(chunks[-1]) + len(sentence) < max_chars:
+            chunks[-1] += " " + sentence
+        else:
+            chunks.append(sentence)
+    return [c for c in chunks if c.strip() != ""]
+
+def record_synthesis(manifest, nr, text, config_dict, key, ofile, reused):
+    if manifest is not None:
+        manifest.record_synthesis(nr, text, hash_key(*tts_config(config_dict)), key, Path(ofile).resolve(), reused)
+
+def reuse_synthesis(nr, text, config_dict, key, ofile, manifest=None):
+    if manifest is not None and (previous := manifest.find_synthesis(key)) is not None:
+        if Path(previous).resolve() != Path(ofile).resolve():
+            shutil.copyfile(previous, ofile)
+    elif not (worker_option("CACHE", "enabled", True, bool) and tts_cache.fetch(key, ofile, ".mp3")):
+        return False
+    record_synthesis(manifest, nr, text, config_dict, key, ofile, True)
+    return True
+
+def worker(working_dir, nr, title, text, config_dict, manifest=None):
+    """Synthesizes a section, the returned future completes once its MP3 is encoded and stored."""
+    ofile = working_dir/".."/f"{nr}-{title}.mp3"
+    use_cache = worker_option("CACHE", "enabled", True, bool)
+    key = synthesis_key(text, config_dict)
+    if reuse_synthesis(nr, text, config_dict, key, ofile, manifest):
+        return encode_async(lambda: None)
 
-def worker(working_dir, nr, title, text, config_dict):
     os.makedirs(working_dir)
+    waveform = None
+    start = time.perf_counter()
 
     # Fish-Speed
     if config_dict["TTS"]["tts_method"] == 'TTS_FISH':
         import locale
         locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
 
-        cmd = ['python', str(Path(config_dict["TTS_FISH"]["generate_py"]).absolute())]
-        cmd += ['--text', text]
-
-        if os.path.isfile(config_dict["TTS"]["voice"] + ".txt") and os.path.isfile(config_dict["TTS"]["voice"] + ".wav"):
-            with open(config_dict["TTS"]["voice"] + ".txt", "r") as f:
-                cmd += ['--prompt-text', ' '.join(f.readlines())]
-            cmd += ['--prompt-tokens', Path(config_dict["TTS"]["voice"] + ".npy").absolute()]
-
-        cmd += ['--checkpoint-path', str(Path(config_dict["TTS_FISH"]["fishspeech_chkp_path"]).absolute())]
-        cmd += ['--num-samples' , config_dict["TTS_FISH"]["num_samples"]]
-        cmd += ['--top-p' , config_dict["TTS_FISH"]["top_p"]]
-        cmd += ['--repetition-penalty' , config_dict["TTS_FISH"]["repetition_penalty"]]
-        cmd += ['--temperature' , config_dict["TTS_FISH"]["temperature"]]
-        cmd += ['--seed' , config_dict["TTS_FISH"]["seed"]]
-        cmd += ['--chunk-length', config_dict["TTS_FISH"]["chunk_length"]]
+        if fish_engine_enabled(config_dict):
+            waveform, sample_rate = synthesize_waveform(text, config_dict)
+        else:
+            cmd = ['python', str(Path(config_dict["TTS_FISH"]["generate_py"]).absolute())]
+            cmd += ['--text', text]
+
+            prompt_text, _ = fish_prompt(config_dict)
+            if prompt_text is not None:
+                cmd += ['--prompt-text', prompt_text]
+                cmd += ['--prompt-tokens', voice_registry.artifact(config_dict["TTS"]["voice"], "fish-tokens").absolute()]
+
+            cmd += ['--checkpoint-path', str(Path(config_dict["TTS_FISH"]["fishspeech_chkp_path"]).absolute())]
+            cmd += ['--num-samples' , config_dict["TTS_FISH"]["num_samples"]]
+            cmd += ['--top-p' , config_dict["TTS_FISH"]["top_p"]]
+            cmd += ['--repetition-penalty' , config_dict["TTS_FISH"]["repetition_penalty"]]
+            cmd += ['--temperature' , config_dict["TTS_FISH"]["temperature"]]
+            cmd += ['--seed' , config_dict["TTS_FISH"]["seed"]]
+            cmd += ['--chunk-length', config_dict["TTS_FISH"]["chunk_length"]]
     
 
-        if config_dict["TTS_FISH"]["compile"] == "True":
-            cmd += ['--compile']
+            if config_dict["TTS_FISH"]["compile"] == "True":
+                cmd += ['--compile']
 
-        subprocess.run(cmd, cwd=working_dir)
+            subprocess.run(cmd, cwd=working_dir)
 
-        cmd = ['python', str(Path(config_dict["TTS_FISH"]["inference_py"]).absolute())]
-        cmd += ['-i' , working_dir/'codes_0.npy']
-        cmd += ['--checkpoint-path', str(Path(config_dict["TTS_FISH"]["generator_pth"]).absolute())]
-        subprocess.run(cmd, cwd=working_dir)
+            cmd = ['python', str(Path(config_dict["TTS_FISH"]["inference_py"]).absolute())]
+            cmd += ['-i' , working_dir/'codes_0.npy']
+            cmd += ['--checkpoint-path', str(Path(config_dict["TTS_FISH"]["generator_pth"]).absolute())]
+            subprocess.run(cmd, cwd=working_dir)
 
     # XTTS
     elif config_dict["TTS"]["tts_method"] == 'TTS_XTTSv2':
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-
-        speaker_wav = str(Path(config_dict["TTS"]["voice"]+".wav").absolute()) if config_dict["TTS"]["voice"].split("/")[-1] != "Default" \
-                        else str((Path(config_dict["TTS_XTTSv2"]["default_voice"])).absolute())
-        tts = TTS(config_dict["TTS_XTTSv2"]["model"]).to(device)
-
-        tts.tts_to_file(text=text,
-                        file_path=working_dir/"fake.wav",
-                        speaker_wav=speaker_wav,
-                        language=config_dict["TTS_XTTSv2"]["lang"],
-                        emotion=config_dict["TTS_XTTSv2"]["emotion"],
-                        speed=config_dict["TTS_XTTSv2"]["speed"],
-                        split_sentences=(config_dict["TTS_XTTSv2"]["split_sentences"] == "True"))
+        waveform, sample_rate = synthesize_waveform(text, config_dict, split_sentences=(config_dict["TTS_XTTSv2"]["split_sentences"] == "True"))
     # OpenAI API
     else:
-        import openai
-        client = openai.OpenAI(
-            api_key=config_dict["TTS_OPENAI"]["api_key"],
-            base_url=config_dict["TTS_OPENAI"]["base_url"]
-        )
-
-        with client.audio.speech.with_streaming_response.create(
-            model=config_dict["TTS_OPENAI"]["model"],
-            voice=config_dict["TTS_OPENAI"]["voice"],
-            speed=config_dict["TTS_OPENAI"]["speed"],
-            response_format="mp3",
-            input=text,
-        ) as response:
-            response.stream_to_file(working_dir/".."/f"{nr}-{title}.mp3")
-
-    if not os.path.exists(working_dir/".."/f"{nr}-{title}.mp3"):
-        AudioSegment.from_wav(working_dir/"fake.wav").export(working_dir/".."/f"{nr}-{title}.mp3", format="mp3")
-    shutil.rmtree(working_dir)
-
-
-def do_make_tts(titles, script, odir, config_dict):
-    if False:
-        with Manager() as manager:
-            with Pool(NR_WORKER) as pool:
-                for i, (title, text) in enumerate(zip(titles, script)):
-                    working_dir = odir / ("%x" % random.randrange(2 ** 32))
-                    _ = pool.apply_async(worker, (working_dir, i, title, text))
-
-                pool.close()
-                pool.join()
-    else:
-        for i, (title, text) in enumerate(zip(titles, script)):
-            working_dir = Path(odir) / ("%x" % random.randrange(2 ** 32))
-            worker(working_dir, i, title, text, config_dict)
+        openai_speech(text, config_dict, ofile)
+
+    metrics.observe("synthesis", time.perf_counter() - start, method=config_dict["TTS"]["tts_method"])
+
+    # encoding runs on the encoder pool while the next section is synthesized
+    def finish():
+        if waveform is not None:
+            do_export_waveform(waveform, sample_rate, ofile)
+        elif not os.path.exists(ofile):
+            do_convert_mp3(working_dir/"fake.wav", ofile)
+        shutil.rmtree(working_dir)
+        if use_cache:
+            tts_cache.store(key, ofile, ".mp3")
+        record_synthesis(manifest, nr, text, config_dict, key, ofile, False)
+    return encode_async(finish)
+
+
+def do_make_tts_streaming(nr, title, text, odir, config_dict, on_chunk=None, manifest=None):
+    """Synthesizes a section chunk by chunk, every chunk is playable as soon as it is encoded."""
+    ofile = Path(odir) / f"{nr}-{title}.mp3"
+    use_cache = worker_option("CACHE", "enabled", True, bool)
+    key = synthesis_key(text, config_dict)
+    if reuse_synthesis(nr, text, config_dict, key, ofile, manifest):
+        if on_chunk is not None:
+            on_chunk(0, str(ofile))
+        return {"nr": nr, "title": title, "file": str(ofile)}
+
+    segments_dir = Path(odir) / ".segments" / f"{nr}"
+    os.makedirs(segments_dir, exist_ok=True)
+    growing = ofile.with_name(ofile.name + ".part")
+    with open(growing, "wb") as f:
+        def append(i, segment, encoding):
+            encoding.result()
+            f.write(segment.read_bytes())
+            f.flush()
+            if on_chunk is not None:
+                on_chunk(i, str(segment))
+
+        # segments are bare MP3 frames, so the growing file stays a valid stream
+        pending = None
+        for i, chunk in enumerate(split_chunks(text, int(config_dict["TTS"].get("chunk_chars", 250)))):
+            segment = segments_dir / f"{i:03d}.mp3"
+            with metrics.span("synthesis", method=config_dict["TTS"]["tts_method"]):
+                if config_dict["TTS"]["tts_method"] == 'TTS_OPENAI':
+                    openai_speech(chunk, config_dict, segments_dir / f"{i:03d}.api.mp3")
+                    encoding = encode_async(do_remux_mp3, segments_dir / f"{i:03d}.api.mp3", segment, True)
+                else:
+                    encoding = encode_async(do_export_waveform, *synthesize_waveform(chunk, config_dict), segment, True)
+            if pending is not None:
+                append(*pending)
+            pending = (i, segment, encoding)
+        if pending is not None:
+            append(*pending)
+
+    do_remux_mp3(growing, ofile)
+    os.remove(growing)
+    if use_cache:
+        tts_cache.store(key, ofile, ".mp3")
+    record_synthesis(manifest, nr, text, config_dict, key, ofile, False)
+    return {"nr": nr, "title": title, "file": str(ofile)}
+
+def do_remove_segments(files):
+    # the chunks were played by now, the sections are complete
+    for odir in {Path(f).parent for f in files}:
+        shutil.rmtree(odir / ".segments", ignore_errors=True)
+    return {"status": "complete"}
+
+def do_make_tts_section(nr, title, text, odir, config_dict, manifest=None):
+    working_dir = Path(odir) / ("%x" % random.randrange(2 ** 32))
+    worker(working_dir, nr, title, text, config_dict, manifest).result()
+    return {"nr": nr, "title": title, "file": str(Path(odir) / f"{nr}-{title}.mp3")}
 
+def section_lanes(nr_sections, max_parallel):
+    nr_lanes = max(1, min(max_parallel, nr_sections))
+    return [list(range(lane, nr_sections, nr_lanes)) for lane in range(nr_lanes)]
 
+def do_make_tts_lane(sections, odir, config_dict, on_section=None, manifest=None):
+    """Synthesizes (nr, title, text) sections one after another, each one is encoded while the next one is synthesized."""
+    results = []
+    def finish(nr, title, encoding):
+        encoding.result()
+        results.append({"nr": nr, "title": title, "file": str(Path(odir) / f"{nr}-{title}.mp3")})
+        if on_section is not None:
+            on_section(nr)
 
+    pending = None
+    for nr, title, text in sections:
+        encoding = worker(Path(odir) / ("%x" % random.randrange(2 ** 32)), nr, title, text, config_dict, manifest)
+        if pending is not None:
+            finish(*pending)
+        pending = (nr, title, encoding)
+    if pending is not None:
+        finish(*pending)
+    return results
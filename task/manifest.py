@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from task.disk_cache import hash_bytes, hash_file, hash_key
+from task.worker_config import worker_option
+
+listenable_keys = ["model", "system_prompt", "user_prompt_template", "context_mode"]
+
+def hash_text(text):
+    return hash_bytes(text.encode())
+
+def listenable_config_hash(config_dict):
+    return hash_key({k: config_dict["LISTENABLE"].get(k) for k in listenable_keys})
+
+def voice_files(config_dict):
+    tts_method = config_dict["TTS"]["tts_method"]
+    if tts_method == 'TTS_OPENAI':
+        return []
+    if config_dict["TTS"]["voice"].split("/")[-1] == "Default":
+        default_voice = config_dict[tts_method].get("default_voice", "")
+        return [default_voice] if os.path.isfile(default_voice) else []
+    return [config_dict["TTS"]["voice"] + ext for ext in [".wav", ".txt"] if os.path.isfile(config_dict["TTS"]["voice"] + ext)]
+
+def tts_config(config_dict):
+    tts_method = config_dict["TTS"]["tts_method"]
+    params = {k: v for k, v in config_dict[tts_method].items() if k not in ["api_key", "engine"]}
+    return [hash_file(f) for f in voice_files(config_dict)], tts_method, params
+
+
+class JobManifest:
+    """Records the inputs and outputs of every stage of one PDF, so a re-run only recomputes sections whose inputs changed."""
+
+    def __init__(self, path, job_id=None, max_runs=20, max_entries=1000):
+        self.path = Path(path)
+        self.job_id = str(job_id)
+        self.max_runs = max_runs
+        self.max_entries = max_entries
+        os.makedirs(self.path.parent, exist_ok=True)
+
+    @classmethod
+    def for_pdf(cls, pdf_hash, job_id=None):
+        return cls(Path(worker_option("MANIFEST", "dir", "data/jobs")) / pdf_hash[:16] / "manifest.json", job_id,
+                   max_runs=worker_option("MANIFEST", "max_runs", 20, int),
+                   max_entries=worker_option("MANIFEST", "max_entries", 1000, int))
+
+    def load(self):
+        if not self.path.is_file():
+            return {"conversion": {}, "runs": {}, "rewrites": {}, "syntheses": {}}
+        data = json.loads(self.path.read_text())
+        if "runs" not in data:
+            # manifests without per-job runs are outdated, they are started over
+            return {"conversion": {}, "runs": {}, "rewrites": {}, "syntheses": {}}
+        return data
+
+    @contextmanager
+    def update(self):
+        # sections of one PDF are recorded concurrently by several workers
+        with open(self.path.with_name(self.path.name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self.load()
+            yield data
+            self.prune(data)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps(data, indent=1))
+            os.replace(tmp, self.path)
+
+    def prune(self, data):
+        # only the latest runs and the most recently used rewrites and syntheses are kept
+        runs = sorted(data["runs"].items(), key=lambda r: r[1]["started"], reverse=True)
+        data["runs"] = dict(runs[:self.max_runs])
+        for name in ["rewrites", "syntheses"]:
+            entries = sorted(data[name].items(), key=lambda e: e[1]["used"], reverse=True)
+            data[name] = dict(entries[:self.max_entries])
+
+    def sections(self, data):
+        run = data["runs"].setdefault(self.job_id, {"started": time.time(), "sections": {}})
+        return run["sections"]
+
+    def record_conversion(self, pdf_hash, markdown, reused):
+        with self.update() as data:
+            data["pdf_hash"] = pdf_hash
+            data["conversion"] = {"markdown": hash_text(markdown), "reused": reused}
+            self.sections(data)
+
+    def rewrite_key(self, text, context, config_dict):
+        return hash_key(hash_text(text), hash_text(context), listenable_config_hash(config_dict))
+
+    def find_rewrite(self, text, context, config_dict):
+        entry = self.load()["rewrites"].get(self.rewrite_key(text, context, config_dict))
+        return entry["script"] if entry is not None else None
+
+    def record_rewrite(self, nr, title, text, context, config_dict, script, reused):
+        with self.update() as data:
+            data["rewrites"][self.rewrite_key(text, context, config_dict)] = {"script": script, "used": time.time()}
+            self.sections(data).setdefault(str(nr), {}).update(
+                title=title, source=hash_text(text), context=hash_text(context),
+                listenable_config=listenable_config_hash(config_dict), script=hash_text(script), llm_reused=reused)
+
+    def find_synthesis(self, key):
+        entry = self.load()["syntheses"].get(key)
+        return entry["file"] if entry is not None and os.path.isfile(entry["file"]) else None
+
+    def record_synthesis(self, nr, script, tts_config, key, file, reused):
+        with self.update() as data:
+            data["syntheses"][key] = {"file": str(file), "used": time.time()}
+            self.sections(data).setdefault(str(nr), {}).update(
+                script=hash_text(script), tts_config=tts_config, file=str(file), tts_reused=reused)
+
+    def summary(self):
+        sections = self.load()["runs"].get(self.job_id, {"sections": {}})["sections"].values()
+        return {stage: {"reused": sum(1 for s in sections if s.get(f"{stage}_reused")),
+                        "recomputed": sum(1 for s in sections if s.get(f"{stage}_reused") is False)}
+                for stage in ["llm", "tts"]}
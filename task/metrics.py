@@ -0,0 +1,112 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Metrics:
+    """Collects span durations and counters of a worker process, per process for Prometheus and per task for the job breakdown."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.local = threading.local()
+
+    @property
+    def collector(self):
+        return getattr(self.local, "collector", None)
+
+    @collector.setter
+    def collector(self, collector):
+        self.local.collector = collector
+
+    def bind(self, func):
+        # threads of a pool report to the task that submitted the work
+        collector = self.collector
+        def bound(*args, **kwargs):
+            previous, self.collector = self.collector, collector
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.collector = previous
+        return bound
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            count, total, peak = self.spans.get(key, (0, 0.0, 0.0))
+            self.spans[key] = (count + 1, total + seconds, max(peak, seconds))
+            if self.collector is not None:
+                self.collector[name] = self.collector.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @staticmethod
+    def memory():
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        gauges = {"process_resident_bytes": resident,
+                  "process_peak_resident_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+        if "torch" in sys.modules and sys.modules["torch"].cuda.is_available():
+            gauges["cuda_allocated_bytes"] = sys.modules["torch"].cuda.memory_allocated()
+            gauges["cuda_peak_allocated_bytes"] = sys.modules["torch"].cuda.max_memory_allocated()
+        return gauges
+
+    def render(self):
+        def labels(pairs):
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in pairs) + "}" if pairs else ""
+
+        with self.lock:
+            spans = sorted(self.spans.items())
+            lines = ["# TYPE paper2go_span_seconds summary"]
+            for (name, pairs), (count, total, _) in spans:
+                lines.append(f"paper2go_span_seconds_count{labels((('span', name),) + pairs)} {count}")
+                lines.append(f"paper2go_span_seconds_sum{labels((('span', name),) + pairs)} {total:.6f}")
+            lines.append("# TYPE paper2go_span_max_seconds gauge")
+            lines += [f"paper2go_span_max_seconds{labels((('span', name),) + pairs)} {peak:.6f}" for (name, pairs), (_, _, peak) in spans]
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE paper2go_{name}_total counter")
+                lines += [f"paper2go_{name}_total{labels(pairs)} {value}" for (n, pairs), value in sorted(self.counters.items()) if n == name]
+        for name, value in self.memory().items():
+            lines += [f"# TYPE paper2go_{name} gauge", f"paper2go_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+metrics = Metrics()
@@ -0,0 +1,151 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import gc
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from task.metrics import metrics
+from task.worker_config import worker_option
+
+
+class ModelEntry:
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class ModelRegistry:
+    """Keeps loaded models resident per worker process, keyed by e.g. (model, device)."""
+
+    def __init__(self, max_models=1, idle_timeout=0, on_evict=None, name="models"):
+        self.name = name
+        self.max_models = max_models
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.stats = {"loads": 0, "hits": 0, "evictions": 0, "load_seconds": 0.0, "run_seconds": 0.0}
+        if idle_timeout > 0:
+            threading.Thread(target=self.__reaper, daemon=True).start()
+
+    def get(self, key, loader, hold=False):
+        while True:
+            with self.lock:
+                self.__evict(idle_only=True, keep=key)
+                if key in self.entries:
+                    entry = self.entries[key]
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    entry.last_used = time.monotonic()
+                    entry.users += int(hold)
+                    return entry
+                # the first caller loads, others wait for it without blocking the registry for other keys
+                loading, owner = self.loading.get(key), key not in self.loading
+                if owner:
+                    loading = self.loading[key] = Future()
+            if owner:
+                return self.__load(key, loader, loading, hold)
+            loading.result()
+
+    def __load(self, key, loader, loading, hold):
+        start = time.perf_counter()
+        try:
+            entry = ModelEntry(loader())
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            loading.set_exception(e)
+            raise
+        metrics.observe("model_load", time.perf_counter() - start, registry=self.name)
+        with self.lock:
+            self.stats["load_seconds"] += time.perf_counter() - start
+            self.stats["loads"] += 1
+            entry.users += int(hold)
+            self.entries[key] = entry
+            del self.loading[key]
+            self.__evict(idle_only=False, keep=key)
+        loading.set_result(None)
+        return entry
+
+    @contextmanager
+    def use(self, key, loader):
+        with self.hold(key, loader, exclusive=True) as model:
+            yield model
+
+    @contextmanager
+    def hold(self, key, loader, exclusive=False):
+        """Keeps the model resident while it is in use, exclusive for models that are not thread-safe."""
+        entry = self.get(key, loader, hold=True)
+        try:
+            if exclusive:
+                entry.lock.acquire()
+            with self.timed():
+                yield entry.model
+        finally:
+            if exclusive:
+                entry.lock.release()
+            with self.lock:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+                self.__evict(idle_only=False)
+
+    @contextmanager
+    def timed(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stats["run_seconds"] += time.perf_counter() - start
+
+    def warmup(self, key, loader):
+        self.get(key, loader)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, resident=[list(k) for k in self.entries.keys()])
+
+    def __reaper(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 2, 1))
+            with self.lock:
+                self.__evict(idle_only=True)
+
+    def __evict(self, idle_only, keep=None):
+        now = time.monotonic()
+        evicted = False
+        for key, entry in list(self.entries.items()):
+            if key == keep or entry.users > 0 or entry.lock.locked():
+                continue
+            idle = self.idle_timeout > 0 and now - entry.last_used > self.idle_timeout
+            over = not idle_only and len(self.entries) > max(self.max_models, 1)
+            if idle or over:
+                del self.entries[key]
+                self.stats["evictions"] += 1
+                evicted = True
+                if self.on_evict is not None:
+                    self.on_evict(entry.model)
+        if evicted:
+            gc.collect()
+
+
+def release_model(model):
+    if hasattr(model, "close"):
+        model.close()
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def tts_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+tts_registry = ModelRegistry(max_models=worker_option("WORKER", "max_resident_models", 1, int),
+                             idle_timeout=worker_option("WORKER", "model_idle_timeout", 0, float),
+                             on_evict=release_model, name="tts")
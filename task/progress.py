@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import json
+import time
+import redis
+import celeryconfig
+
+
+class Progress:
+    """Publishes task progress events to one Redis stream per job, the UI blocks on the streams instead of polling."""
+
+    def __init__(self, url=celeryconfig.broker_url, retention=24 * 3600):
+        self.redis = redis.Redis.from_url(url)
+        self.retention = retention
+
+    @staticmethod
+    def stream(job_id):
+        return f"paper2go:progress:{job_id}"
+
+    def publish(self, job_id, stage, state="PROGRESS", done=None, total=None, **extra):
+        if job_id is None:
+            return
+        event = dict(extra, stage=stage, state=state, done=done, total=total, time=time.time())
+        pipe = self.redis.pipeline()
+        pipe.xadd(self.stream(job_id), {"event": json.dumps(event)}, maxlen=10000, approximate=True)
+        pipe.expire(self.stream(job_id), self.retention)
+        pipe.execute()
+
+    def read(self, last_ids, timeout=1.0):
+        """Returns the events of the jobs in last_ids after the given entry ids and advances them, an empty list after the timeout."""
+        response = self.redis.xread({self.stream(job_id): entry_id for job_id, entry_id in last_ids.items()}, block=int(timeout * 1000))
+        events = []
+        for stream, entries in response or []:
+            job_id = stream.decode().removeprefix(self.stream(""))
+            for entry_id, fields in entries:
+                last_ids[job_id] = entry_id
+                events.append((job_id, json.loads(fields[b"event"])))
+        return events
+
+    def listen(self, job_ids, timeout=1.0):
+        last_ids = {job_id: "0-0" for job_id in job_ids}
+        while True:
+            events = self.read(last_ids, timeout)
+            if not events:
+                yield None, None
+            yield from events
+
+
+class StageProgress:
+    """Aggregates the events of one job into per-stage progress and an ETA."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.state = {stage: {"done": set(), "total": None, "start": None, "state": "PENDING"} for stage in stages}
+        self.failed = None
+        self.timing = {}
+
+    def update(self, event):
+        if event["state"] == "TIMING":
+            for name, seconds in event["spans"].items():
+                self.timing[name] = self.timing.get(name, 0.0) + seconds
+            return
+        if event["state"] == "FAILURE":
+            self.failed = event
+        if event["stage"] not in self.state:
+            return
+        stage = self.state[event["stage"]]
+        if stage["start"] is None:
+            stage["start"] = event["time"]
+        if event["total"] is not None:
+            stage["total"] = event["total"]
+        if event["done"] is not None:
+            stage["done"].add(event["done"])
+        if event.get("reuse") is not None:
+            stage["reuse"] = event["reuse"]
+        stage["state"] = event["state"]
+
+    def fail(self, error):
+        stage = self.stages[min(self.current, len(self.stages) - 1)]
+        self.failed = {"stage": stage, "state": "FAILURE", "error": error, "time": time.time()}
+
+    @property
+    def current(self):
+        for i, stage in enumerate(self.stages):
+            if self.state[stage]["state"] != "SUCCESS":
+                return i
+        return len(self.stages)
+
+    @property
+    def finished(self):
+        return self.failed is not None or self.current == len(self.stages)
+
+    def fraction(self, stage):
+        s = self.state[stage]
+        if s["state"] == "SUCCESS":
+            return 1.0
+        return len(s["done"]) / s["total"] if s["total"] else 0.0
+
+    def eta(self, stage):
+        s = self.state[stage]
+        if s["start"] is None or not s["total"] or len(s["done"]) == 0:
+            return None
+        elapsed = time.time() - s["start"]
+        return elapsed / len(s["done"]) * (s["total"] - len(s["done"]))
+
+
+progress = Progress()
@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import re
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(name):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(name)
+
+def count_tokens(text, config_dict):
+    # without a tokenizer, about four characters per token is close enough for budgeting
+    name = config_dict["LISTENABLE"].get("tokenizer", "").strip()
+    if name == "":
+        return (len(text) + 3) // 4
+    return len(load_tokenizer(name).encode(text, add_special_tokens=False))
+
+def text_budget(config_dict):
+    """Tokens left per section once the system prompt, the prompt template, and the context are accounted for."""
+    budget = int(config_dict["LISTENABLE"].get("token_budget", 0))
+    if budget <= 0:
+        return 0
+    fixed = count_tokens(config_dict["LISTENABLE"]["system_prompt"], config_dict) + \
+            count_tokens(config_dict["LISTENABLE"]["user_prompt_template"].format(text="", context=""), config_dict)
+    # the context holds at most two sections (the first rewritten one and the predecessor), each within the budget
+    available = (budget - fixed) // 3
+    if available <= 0:
+        raise ValueError(f"token_budget = {budget} leaves no room for the section text after the prompts ({fixed} tokens)")
+    return available
+
+def split_paragraphs(title, text, budget, config_dict):
+    """Splits at paragraphs, or at sentences within a paragraph above the budget, returns titles, parts, and their token counts."""
+    parts, sizes = [], []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if paragraph == "":
+            continue
+        tokens = count_tokens(paragraph, config_dict)
+        pieces = [(paragraph, tokens)] if tokens <= budget else \
+                 [(sentence, count_tokens(sentence, config_dict)) for sentence in re.split(r"(?<=[.!?])\s+", paragraph)]
+        separator = "\n\n"
+        for piece, size in pieces:
+            if parts and sizes[-1] + size <= budget:
+                parts[-1] += separator + piece
+                sizes[-1] += size
+            else:
+                parts.append(piece)
+                sizes.append(size)
+            separator = " "
+    if len(parts) <= 1:
+        return [title], [text.strip()], [count_tokens(text.strip(), config_dict)]
+    return [f"{title} (part {i + 1})" for i in range(len(parts))], parts, sizes
+
+def budget_sections(titles, texts, config_dict):
+    """Splits sections above the token budget at paragraphs and merges small neighbours, the first title names a merged section."""
+    budget = text_budget(config_dict)
+    if budget <= 0:
+        return titles, texts
+
+    merged_titles, merged_texts, merged_tokens, mergeable = [], [], [], []
+    for title, text in zip(titles, texts):
+        tokens = count_tokens(text, config_dict)
+        if tokens > budget:
+            # parts of a split section keep their own titles and are never merged
+            parts = split_paragraphs(title, text, budget, config_dict)
+            merged_titles += parts[0]
+            merged_texts += parts[1]
+            merged_tokens += parts[2]
+            mergeable += [False] * len(parts[1])
+        elif mergeable and mergeable[-1] and merged_tokens[-1] + tokens <= budget and min(merged_tokens[-1], tokens) < budget // 4:
+            merged_texts[-1] += "\n\n" + text
+            merged_tokens[-1] += tokens
+        else:
+            merged_titles.append(title)
+            merged_texts.append(text)
+            merged_tokens.append(tokens)
+            mergeable.append(True)
+    return merged_titles, merged_texts
@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import fcntl
+import glob
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from task.disk_cache import hash_file, hash_key
+
+
+artifact_names = ("xtts-gpt", "xtts-speaker", "fish-tokens")
+
+def compute_xtts_conditioning(xtts_model, wav_file):
+    return xtts_model.get_conditioning_latents(
+        audio_path=[str(wav_file)],
+        gpt_cond_len=xtts_model.config.gpt_cond_len,
+        gpt_cond_chunk_len=xtts_model.config.gpt_cond_chunk_len,
+        max_ref_length=xtts_model.config.max_ref_len,
+        sound_norm_refs=xtts_model.config.sound_norm_refs)
+
+
+class VoiceRegistry:
+    """Stores the per-engine conditioning artifacts of a voice next to its WAV, tagged with the hash of WAV and transcript."""
+
+    def __init__(self):
+        self.loaded = {}
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    def voice_hash(self, voice):
+        wav, transcript = Path(str(voice) + ".wav"), Path(str(voice) + ".txt")
+        stamp = (str(voice), wav.stat().st_mtime_ns, transcript.stat().st_mtime_ns if transcript.is_file() else None)
+        with self.lock:
+            if stamp not in self.hashes:
+                self.hashes[stamp] = hash_key(hash_file(wav), transcript.read_text() if transcript.is_file() else "")[:16]
+            return self.hashes[stamp]
+
+    def artifact(self, voice, name):
+        return Path(f"{voice}.{name}.{self.voice_hash(voice)}.npy")
+
+    def prepare(self, voice, engines, xtts_model=None, encode_fish=None):
+        if "TTS_XTTSv2" in engines and xtts_model is not None:
+            self.xtts_conditioning(voice, xtts_model)
+        if "TTS_FISH" in engines and encode_fish is not None:
+            self.fish_prompt_tokens(voice, encode_fish)
+        self.remove_stale(voice)
+
+    def remove_stale(self, voice):
+        tag = self.voice_hash(voice)
+        for name in artifact_names:
+            for file in Path(voice).parent.glob(f"{glob.escape(Path(voice).name)}.{name}.{'?' * len(tag)}.npy"):
+                if not file.name.endswith(f".{tag}.npy"):
+                    file.unlink(missing_ok=True)
+
+    def xtts_conditioning(self, voice, xtts_model):
+        import torch
+        gpt_file, speaker_file = self.artifact(voice, "xtts-gpt"), self.artifact(voice, "xtts-speaker")
+        if not gpt_file.is_file() or not speaker_file.is_file():
+            with self.__computing(voice):
+                if not gpt_file.is_file() or not speaker_file.is_file():
+                    gpt_cond_latent, speaker_embedding = compute_xtts_conditioning(xtts_model, str(voice) + ".wav")
+                    self.__save(speaker_file, lambda tmp: np.save(tmp, speaker_embedding.cpu().numpy()))
+                    self.__save(gpt_file, lambda tmp: np.save(tmp, gpt_cond_latent.cpu().numpy()))
+        return torch.tensor(self.__load(gpt_file)), torch.tensor(self.__load(speaker_file))
+
+    def fish_prompt_tokens(self, voice, encode_fish):
+        tokens_file = self.artifact(voice, "fish-tokens")
+        if not tokens_file.is_file():
+            with self.__computing(voice):
+                if not tokens_file.is_file():
+                    self.__save(tokens_file, lambda tmp: encode_fish(str(voice) + ".wav", tmp))
+        return self.__load(tokens_file)
+
+    def __load(self, file):
+        with self.lock:
+            if str(file) not in self.loaded:
+                self.loaded[str(file)] = np.load(file, mmap_mode="r")
+            return self.loaded[str(file)]
+
+    @staticmethod
+    @contextmanager
+    def __computing(voice):
+        # threads, worker processes, and XTTS replicas compute a new voice only once
+        with open(Path(voice).parent / f".{Path(voice).name}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def __save(file, write):
+        fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=f".{file.name}.", suffix=".tmp.npy")
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, file)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
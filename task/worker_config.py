@@ -0,0 +1,21 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import configparser
+from functools import lru_cache
+
+config_path = "paper2go.ini"
+
+@lru_cache(maxsize=None)
+def load_worker_config():
+    parser = configparser.ConfigParser()
+    parser.read(config_path)
+    return {section: dict(parser.items(section)) for section in parser.sections()}
+
+def worker_option(section, key, fallback=None, type=str):
+    value = load_worker_config().get(section, {}).get(key)
+    if value is None or value.strip() == "":
+        return fallback
+    if type is bool:
+        return value == "True"
+    return type(value)
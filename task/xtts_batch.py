@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+import numpy as np
+import torch
+import torch.nn.functional as F
+from TTS.tts.layers.xtts.tokenizer import split_sentence
+
+SentenceRequest = namedtuple("SentenceRequest", "tokens gpt_cond_latent speaker_embedding speed future")
+
+
+class BatchedXtts:
+    """Packs sentences of all concurrent requests into padded batches for the autoregressive GPT step of one XTTS model."""
+
+    def __init__(self, tts, max_batch_size=8, max_wait=0.05):
+        self.model = tts.synthesizer.tts_model
+        self.sample_rate = tts.synthesizer.output_sample_rate
+        self.device = next(self.model.parameters()).device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.closed = False
+        self.closing = threading.Lock()
+        self.thread = threading.Thread(target=self.__serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def synthesize(self, text, conditioning, language, speed=1.0):
+        language = language.split("-")[0]
+        gpt_cond_latent, speaker_embedding = conditioning
+        requests = [SentenceRequest(torch.IntTensor(self.model.tokenizer.encode(sentence.strip().lower(), lang=language)),
+                                    gpt_cond_latent, speaker_embedding, float(speed), Future())
+                    for sentence in split_sentence(text, language, self.model.tokenizer.char_limits[language])]
+        futures = [r.future for r in requests]
+        with self.closing:
+            if self.closed:
+                raise RuntimeError("Batched XTTS engine was unloaded")
+            for r in requests:
+                self.requests.put(r)
+        return np.concatenate([f.result() for f in futures]) if futures else np.zeros(0, dtype=np.float32)
+
+    def close(self):
+        # sentences queued before the shutdown are still served, later requests fail right away
+        with self.closing:
+            self.closed = True
+            self.requests.put(None)
+
+    def __serve(self):
+        while (first := self.requests.get()) is not None:
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size and (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.requests.put(None)
+                    break
+                batch.append(item)
+            try:
+                self.__run(batch)
+            except Exception as e:
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+
+    @torch.no_grad()
+    def __run(self, batch):
+        gpt = self.model.gpt
+        config = self.model.config
+
+        length = max(len(r.tokens) for r in batch)
+        text_inputs = torch.full((len(batch), length), gpt.stop_text_token, dtype=torch.int32, device=self.device)
+        cond_latents = torch.cat([r.gpt_cond_latent.to(self.device) for r in batch], dim=0)
+        # the prompt is conditioning, start token, text, stop token, padding, stop token, start audio token;
+        # masking the padding and the second stop token gives every sentence the prompt of unbatched inference
+        prefix = cond_latents.shape[1]
+        attention_mask = torch.ones((len(batch), prefix + length + 3), dtype=torch.long, device=self.device)
+        for i, r in enumerate(batch):
+            text_inputs[i, :len(r.tokens)] = r.tokens.to(self.device)
+            attention_mask[i, prefix + len(r.tokens) + 2:prefix + length + 2] = 0
+
+        codes = gpt.generate(
+            cond_latents=cond_latents,
+            text_inputs=text_inputs,
+            do_sample=True,
+            top_p=config.top_p,
+            top_k=config.top_k,
+            temperature=config.temperature,
+            num_return_sequences=1,
+            num_beams=1,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            output_attentions=False,
+            attention_mask=attention_mask)
+
+        for i, r in enumerate(batch):
+            stops = (codes[i] == gpt.stop_audio_token).nonzero()
+            gpt_codes = codes[i, :int(stops[0]) + 1 if len(stops) > 0 else codes.shape[1]].unsqueeze(0)
+            text_tokens = r.tokens.unsqueeze(0).to(self.device)
+            latents = gpt(text_tokens,
+                          torch.tensor([text_tokens.shape[-1]], device=self.device),
+                          gpt_codes,
+                          torch.tensor([gpt_codes.shape[-1] * gpt.code_stride_len], device=self.device),
+                          cond_latents=r.gpt_cond_latent.to(self.device),
+                          return_attentions=False,
+                          return_latent=True)
+            if r.speed != 1.0:
+                latents = F.interpolate(latents.transpose(1, 2), scale_factor=1.0 / max(r.speed, 0.05), mode="linear").transpose(1, 2)
+            wav = self.model.hifigan_decoder(latents, g=r.speaker_embedding.to(self.device))
+            r.future.set_result(wav.cpu().squeeze().numpy())
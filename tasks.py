@@ -1,31 +1,212 @@
 # SPDX-FileCopyrightText: 2025 Meinhard Kissich
 # SPDX-License-Identifier: MIT
 
-from task.convert_to_markdown import do_convert_to_markdown
+from task.convert_to_markdown import do_convert_to_markdown, do_warmup_docling
 from task.make_listenable import do_make_listenable
-from task.make_tts import do_make_tts
+from task.make_tts import do_make_tts_lane, do_make_tts_section, do_remove_segments, do_make_tts_streaming, do_prepare_voice, do_tts_status, do_warmup, section_lanes
 from task.archive import do_archive
+from task.audiobook import do_make_audiobook
 from task.encode_reference import do_encode_reference
+from task.blob_store import blobs
+from task.progress import progress
+from task.manifest import JobManifest
+from task.job_registry import jobs
+from task.metrics import metrics
+from task.worker_config import worker_option
 
-from celery import Celery
+from celery import Celery, chord
+from celery.result import AsyncResult
+import time
+from celery.signals import before_task_publish, task_failure, task_postrun, task_prerun, worker_process_init, worker_ready
 
-app = Celery(
-    'tasks', 
-    broker='redis://localhost:6379/0', 
-    backend='redis://localhost:6379/0'
-)
+app = Celery('tasks')
+app.config_from_object('celeryconfig')
+
+def consumed_queues():
+    return set(app.amqp.queues.consume_from)
+
+def warmup():
+    # a worker only loads the models of the queues it consumes
+    methods = [m.strip() for m in worker_option("WORKER", "warmup", "").split(",") if m.strip() != ""]
+    if "docling" in methods and "convert" in consumed_queues():
+        do_warmup_docling()
+    if "tts" in consumed_queues():
+        do_warmup(methods)
+
+@worker_process_init.connect
+def warmup_process(**kwargs):
+    warmup()
+
+@worker_ready.connect
+def warmup_worker(sender, **kwargs):
+    # prefork children warm up in worker_process_init, all other pools share this process
+    if not sender.controller.pool_cls.__module__.endswith("prefork"):
+        warmup()
+    if (port := worker_option("WORKER", "metrics_port", 0, int)) > 0:
+        metrics.serve(port)
+    jobs.heartbeat(sender.hostname, worker_option("JOBS", "heartbeat_seconds", 10, float))
+
+def task_stage(task_name):
+    return app.conf.task_routes.get(task_name, {}).get("queue", "celery")
+
+@before_task_publish.connect
+def stamp_published(headers=None, **kwargs):
+    headers["published_at"] = time.time()
+
+@task_prerun.connect
+def start_task_span(task=None, **kwargs):
+    metrics.collector = {}
+    task.request.started_at = time.perf_counter()
+    if (published_at := getattr(task.request, "published_at", None)) is not None:
+        metrics.observe("queue_wait", max(time.time() - published_at, 0.0), queue=task_stage(task.name))
+
+@task_postrun.connect
+def finish_task_span(task=None, kwargs=None, **kw):
+    metrics.observe("task", time.perf_counter() - task.request.started_at, task=task.name)
+    spans, metrics.collector = metrics.collector, None
+    progress.publish((kwargs or {}).get("job_id"), task_stage(task.name), state="TIMING", task=task.name, spans=spans)
+
+@task_prerun.connect
+def track_running(task=None, task_id=None, kwargs=None, **kw):
+    # listeners find the worker of every running task, to notice when it dies
+    if (kwargs or {}).get("job_id") is not None:
+        jobs.task_started(kwargs["job_id"], task_id, task.request.hostname)
+
+@task_postrun.connect
+def untrack_running(task_id=None, kwargs=None, **kw):
+    if (kwargs or {}).get("job_id") is not None:
+        jobs.task_finished(kwargs["job_id"], task_id)
+
+@task_failure.connect
+def publish_failure(sender=None, exception=None, kwargs=None, **kw):
+    stage = task_stage(sender.name)
+    progress.publish((kwargs or {}).get("job_id"), stage, state="FAILURE", error=str(exception))
+    if (kwargs or {}).get("job_id") is not None:
+        jobs.finish(kwargs["job_id"], succeeded=False)
 
 @app.task
-def convert_to_markdown(file_bytes, ofile=None):
-    return do_convert_to_markdown(file_bytes, ofile=None)
+def convert_to_markdown(file_bytes, ofile=None, job_id=None):
+    progress.publish(job_id, "convert", state="STARTED", total=1)
+    result = do_convert_to_markdown(blobs.resolve(file_bytes), ofile)
+    JobManifest.for_pdf(result["pdf_hash"], job_id).record_conversion(result["pdf_hash"], result["markdown"], result["cached"])
+    result["markdown"] = blobs.offload(result["markdown"])
+    progress.publish(job_id, "convert", state="SUCCESS", done=0, total=1)
+    return result
 
 @app.task
-def make_listenable(markdown, config_dict, ofile=None):
-    return do_make_listenable(markdown, config_dict, ofile)
+def make_listenable(markdown, config_dict, ofile=None, job_id=None, pdf_hash=None):
+    progress.publish(job_id, "llm", state="STARTED")
+    def on_section(nr, title, text, total):
+        progress.publish(job_id, "llm", done=nr, total=total)
+
+    result = do_make_listenable(blobs.resolve(markdown), blobs.resolve(config_dict), ofile, on_section=on_section,
+                                manifest=JobManifest.for_pdf(pdf_hash, job_id) if pdf_hash else None)
+    result["script"] = blobs.offload(result["script"])
+    result["pdf_hash"] = pdf_hash
+    progress.publish(job_id, "llm", state="SUCCESS", reuse=result.get("reuse"))
+    return result
 
 @app.task
-def make_tts(titles, script, odir, config_dict):
-    return do_make_tts(titles, script, odir, config_dict)
+def listenable_stage(converted, config_dict, ofile=None, job_id=None):
+    return make_listenable(converted["markdown"], config_dict, ofile, job_id=job_id, pdf_hash=converted["pdf_hash"])
+
+@app.task(bind=True)
+def tts_stage(self, listenable, odir, config_dict, job_id=None):
+    return self.replace(make_tts.s(listenable["titles"], listenable["script"], odir, config_dict, job_id=job_id,
+                                   pdf_hash=listenable.get("pdf_hash")))
+
+@app.task
+def listenable_tts_stage(converted, odir, config_dict, ofile=None, job_id=None):
+    # every rewritten section is queued for synthesis right away instead of after the whole script
+    progress.publish(job_id, "llm", state="STARTED")
+    tts_tasks = []
+    def on_section(nr, title, text, total):
+        progress.publish(job_id, "llm", done=nr, total=total)
+        if len(tts_tasks) == 0:
+            progress.publish(job_id, "tts", state="STARTED", total=total)
+        tts_tasks.append((nr, make_tts_section.si([], nr, title, text, odir, blobs.offload(config_dict, force=True),
+                                                  job_id=job_id, total=total, pdf_hash=converted["pdf_hash"]).apply_async().id))
+
+    result = do_make_listenable(blobs.resolve(converted["markdown"]), blobs.resolve(config_dict), ofile, on_section=on_section,
+                                manifest=JobManifest.for_pdf(converted["pdf_hash"], job_id))
+    result["script"] = blobs.offload(result["script"])
+    result["tts_tasks"] = [task_id for _, task_id in sorted(tts_tasks)]
+    result["pdf_hash"] = converted["pdf_hash"]
+    progress.publish(job_id, "llm", state="SUCCESS", reuse=result["reuse"])
+    return result
+
+@app.task(bind=True, max_retries=None)
+def collect_streamed_tts(self, listenable, job_id=None):
+    results = [AsyncResult(task_id, app=app) for task_id in listenable["tts_tasks"]]
+    if not all(r.ready() for r in results):
+        # polls once per second, a section task that got lost ends the job after running_timeout_hours
+        if self.request.retries >= worker_option("JOBS", "running_timeout_hours", 6, float) * 3600:
+            raise TimeoutError(f"{sum(not r.ready() for r in results)} section(s) did not finish")
+        raise self.retry(countdown=1)
+    return collect_tts([r.get(disable_sync_subtasks=False) for r in results], job_id=job_id, pdf_hash=listenable.get("pdf_hash"))
+
+@app.task(bind=True)
+def make_tts(self, titles, script, odir, config_dict, job_id=None, pdf_hash=None):
+    script = blobs.resolve(script)
+    progress.publish(job_id, "tts", state="STARTED", total=len(script))
+    if len(script) == 0:
+        progress.publish(job_id, "tts", state="SUCCESS", total=0)
+        return {"status": "complete", "files": [], "titles": []}
+    lanes = section_lanes(len(script), int(blobs.resolve(config_dict)["TTS"].get("max_parallel_sections", 1)))
+    config_dict = blobs.offload(config_dict, force=True)
+
+    # each lane synthesizes its sections one after another in one task, lanes run in parallel
+    header = [make_tts_lane.s([(i, titles[i], script[i]) for i in lane], odir, config_dict,
+                              job_id=job_id, total=len(script), pdf_hash=pdf_hash)
+              for lane in lanes]
+    return self.replace(chord(header, collect_tts.s(job_id=job_id, pdf_hash=pdf_hash)))
+
+@app.task
+def make_tts_lane(sections, odir, config_dict, job_id=None, total=None, pdf_hash=None):
+    config_dict = blobs.resolve(config_dict)
+    if config_dict["TTS"].get("stream_chunks") == "True":
+        done = []
+        for nr, title, text in sections:
+            done = make_tts_section(done, nr, title, text, odir, config_dict, job_id=job_id, total=total, pdf_hash=pdf_hash)
+        return done
+    def on_section(nr):
+        progress.publish(job_id, "tts", done=nr, total=total)
+    return do_make_tts_lane(sections, odir, config_dict, on_section=on_section,
+                            manifest=JobManifest.for_pdf(pdf_hash, job_id) if pdf_hash else None)
+
+@app.task
+def make_tts_section(done, nr, title, text, odir, config_dict, job_id=None, total=None, pdf_hash=None):
+    config_dict = blobs.resolve(config_dict)
+    manifest = JobManifest.for_pdf(pdf_hash, job_id) if pdf_hash else None
+    if config_dict["TTS"].get("stream_chunks") == "True":
+        def on_chunk(chunk, file):
+            progress.publish(job_id, "tts", state="CHUNK", nr=nr, chunk=chunk, file=file)
+        result = do_make_tts_streaming(nr, title, text, odir, config_dict, on_chunk=on_chunk, manifest=manifest)
+    else:
+        result = do_make_tts_section(nr, title, text, odir, config_dict, manifest=manifest)
+    progress.publish(job_id, "tts", done=nr, total=total)
+    return done + [result]
+
+@app.task
+def collect_tts(lanes, job_id=None, pdf_hash=None):
+    sections = sorted((s for lane in lanes for s in lane), key=lambda s: s["nr"])
+    do_remove_segments([s["file"] for s in sections])
+    reuse = JobManifest.for_pdf(pdf_hash, job_id).summary()["tts"] if pdf_hash else None
+    progress.publish(job_id, "tts", state="SUCCESS", done=None, total=len(sections), reuse=reuse)
+    return {"status": "complete", "files": [s["file"] for s in sections], "titles": [s["title"] for s in sections], "reuse": reuse}
+
+@app.task
+def make_audiobook(collected, ofile, job_id=None):
+    progress.publish(job_id, "book", state="STARTED", total=1)
+    result = do_make_audiobook(collected["files"], collected["titles"], ofile)
+    progress.publish(job_id, "book", state="SUCCESS", done=0, total=1)
+    return result
+
+@app.task
+def finish_job(result, job_id=None):
+    # duplicate submissions of the same PDF and config find the results from now on
+    jobs.finish(job_id, succeeded=True)
+    return result
 
 @app.task
 def archive(idir, ofile):
@@ -33,4 +214,12 @@ def archive(idir, ofile):
 
 @app.task
 def encode_reference(ifile, ofile, config_dict):
-    return do_encode_reference(ifile, ofile, config_dict)
+    return do_encode_reference(ifile, ofile, blobs.resolve(config_dict))
+
+@app.task
+def prepare_voice(voice, config_dict):
+    return do_prepare_voice(voice, blobs.resolve(config_dict))
+
+@app.task
+def tts_status():
+    return do_tts_status()
@@ -0,0 +1,61 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import time
+import types
+import pytest
+
+batch = pytest.importorskip("batch", exc_type=ImportError)
+
+stages = {"convert": "Conversion", "llm": "Reformulation", "tts": "Text-to-Speech"}
+
+
+class FakePipeline:
+    def __init__(self, celery_app):
+        pass
+
+    def stages_for(self, output_format):
+        return stages
+
+    def submit(self, file_bytes, working_dir, nr, config, job_id, **kwargs):
+        return {"job_id": job_id, "working_dir": str(working_dir), "nr": nr, "state": "running", "attached": False, "task_ids": []}
+
+    def failure(self, job_id, task_ids=()):
+        return None
+
+
+class FakeProgress:
+    """Finishes every job on its first read."""
+
+    def __init__(self):
+        self.finished = set()
+
+    def read(self, last_ids, timeout=1.0):
+        events = [(job_id, {"stage": stage, "state": "SUCCESS", "done": None, "total": 1, "time": time.time()})
+                  for job_id in last_ids if job_id not in self.finished for stage in stages]
+        self.finished |= set(last_ids)
+        return events
+
+
+@pytest.fixture
+def runner(monkeypatch, tmp_path):
+    monkeypatch.setattr(batch, "PdfPipeline", FakePipeline)
+    monkeypatch.setattr(batch, "progress", FakeProgress())
+    monkeypatch.setattr(batch, "blobs", types.SimpleNamespace(offload=lambda value, force=False: value))
+    # every clock reading is ten seconds later, so the failure checks run as well
+    clock = iter(range(0, 10 ** 6, 10))
+    monkeypatch.setattr(batch, "time", types.SimpleNamespace(time=time.time, monotonic=lambda: next(clock)))
+    return batch.BatchRunner(None, {"TTS": {"streaming": "False"}}, tmp_path / "out", max_in_flight=2)
+
+def test_run_reports_all_documents(runner, tmp_path):
+    documents = []
+    for i in range(3):
+        (tmp_path / f"paper_{i}.pdf").write_bytes(b"%PDF")
+        documents.append((tmp_path / f"paper_{i}.pdf", 5))
+    report = runner.run(documents)
+    assert report["documents"] == 3 and report["done"] == 3 and report["failed"] == []
+    assert report["stages"]["tts"]["documents"] == 3
+    assert all(runner.checkpoint[str(pdf)]["status"] == "done" for pdf, _ in documents)
+
+def test_documents_of_the_same_name_get_different_ids(tmp_path):
+    assert batch.BatchRunner.document_id(tmp_path / "a" / "paper.pdf") != batch.BatchRunner.document_id(tmp_path / "b" / "paper.pdf")
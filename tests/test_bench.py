@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import argparse
+import json
+import re
+import urllib.request
+from pathlib import Path
+import pytest
+from bench.fixtures import make_corpus
+from bench.stubs import fake_ollama, fake_speech
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+def test_corpus_is_deterministic_and_valid(tmp_path):
+    first = make_corpus(tmp_path / "a", nr_docs=2)
+    second = make_corpus(tmp_path / "b", nr_docs=2)
+    assert [f.read_bytes() for f in first] == [f.read_bytes() for f in second]
+    data = first[0].read_bytes()
+    assert data.startswith(b"%PDF-1.4") and data.endswith(b"%%EOF\n")
+    # every xref offset points at the start of its object
+    xref = int(data.rsplit(b"startxref\n", 1)[1].split()[0])
+    offsets = re.findall(rb"(\d{10}) 00000 n", data[xref:])
+    assert all(data[int(offset):].startswith(b"%d 0 obj" % nr) for nr, offset in enumerate(offsets, start=1))
+
+def test_fake_ollama_answers_the_text_to_rewrite():
+    server = fake_ollama(prefill_tokens_per_second=1e6, tokens_per_second=1e6)
+    try:
+        prompt = "Rewrite this:\n```Some section text.```"
+        body = json.loads(post(server.url + "/api/generate", {"model": "m", "system": "sys", "prompt": prompt}))
+        assert body["response"] == "Some section text."
+        assert body["prompt_eval_count"] == len("sys" + prompt) // 4
+        body = json.loads(post(server.url + "/api/chat", {"model": "m", "messages": [{"role": "user", "content": prompt}]}))
+        assert body["message"]["content"] == "Some section text."
+    finally:
+        server.close()
+
+def test_fake_speech_returns_the_mp3():
+    server = fake_speech(b"ID3 audio")
+    try:
+        assert post(server.url + "/v1/audio/speech", {"input": "Hello"}) == b"ID3 audio"
+    finally:
+        server.close()
+
+def test_run_smoke(monkeypatch):
+    for module in ["numpy", "torch", "docling", "ollama", "TTS"]:
+        pytest.importorskip(module)
+    import task.worker_config as worker_config
+    from bench.run import run
+
+    monkeypatch.chdir(Path(__file__).parent.parent)
+    monkeypatch.setattr(worker_config, "config_path", worker_config.config_path)
+    args = argparse.Namespace(docs=1, sections=3, paragraphs=2, tts="synthetic", real_time_factor=0.0, tts_latency_ms=0,
+                              llm_latency_ms=0, prefill_tps=1e6, generate_tps=1e6, context_mode="rewritten",
+                              max_in_flight=1, max_parallel_sections=2)
+    try:
+        result = run(args)
+    finally:
+        worker_config.load_worker_config.cache_clear()
+    assert result["sections"] > 0
+    assert all(result["stages"][stage]["total"] > 0 for stage in result["stages"])
+    assert result["payload_bytes"]["offloaded"] <= result["payload_bytes"]["inline"]
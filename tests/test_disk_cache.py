@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import os
+import time
+from task.disk_cache import DiskCache
+
+
+def test_hit_and_miss(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    assert cache.get_bytes("ab12") is None
+    cache.put_bytes("ab12", b"data", ".txt")
+    assert cache.get_bytes("ab12", ".txt") == b"data"
+    assert cache.snapshot() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+def test_fetch_copies_to_output(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    (tmp_path / "in.mp3").write_bytes(b"audio")
+    cache.store("cd34", tmp_path / "in.mp3", ".mp3")
+    (tmp_path / "out.mp3").write_bytes(b"old")
+    assert cache.fetch("cd34", tmp_path / "out.mp3", ".mp3")
+    assert (tmp_path / "out.mp3").read_bytes() == b"audio"
+    assert not cache.fetch("ef56", tmp_path / "other.mp3", ".mp3")
+    assert not (tmp_path / "other.mp3").exists()
+
+def test_rewriting_the_output_keeps_the_entry(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    (tmp_path / "in.mp3").write_bytes(b"audio")
+    cache.store("cd34", tmp_path / "in.mp3", ".mp3")
+    assert cache.fetch("cd34", tmp_path / "out.mp3", ".mp3")
+    with open(tmp_path / "out.mp3", "wb") as f:
+        f.write(b"other")
+    assert cache.get_bytes("cd34", ".mp3") == b"audio"
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+
+def test_expired_entries_miss(tmp_path):
+    cache = DiskCache(tmp_path / "cache", max_age=60)
+    cache.put_bytes("ab12", b"data")
+    old = time.time() - 120
+    os.utime(cache.path("ab12"), (old, old))
+    assert cache.get_bytes("ab12") is None
+    cache.evict()
+    assert not cache.path("ab12").exists()
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = DiskCache(tmp_path / "cache", max_bytes=12)
+    now = time.time()
+    for i, key in enumerate(["aa01", "bb02", "cc03"]):
+        cache.put_bytes(key, b"1234")
+        os.utime(cache.path(key), (now - 100 + i, now))
+    # reading the oldest entry makes it the most recently used one
+    assert cache.get_bytes("aa01") == b"1234"
+    cache.max_bytes = 10
+    cache.evict()
+    assert cache.path("aa01").exists()
+    assert not cache.path("bb02").exists()
+    assert cache.path("cc03").exists()
+
+def test_eviction_runs_once_the_estimate_exceeds_the_limit(tmp_path):
+    cache = DiskCache(tmp_path / "cache", max_bytes=10, scan_interval=3600)
+    cache.put_bytes("aa01", b"1234")
+    cache.put_bytes("bb02", b"1234")
+    assert cache.estimate == 8
+    os.utime(cache.path("aa01"), (time.time() - 100, time.time()))
+    cache.put_bytes("cc03", b"1234")
+    assert not cache.path("aa01").exists()
+    assert cache.estimate == 8
+
+def test_entry_removed_after_lookup_is_a_miss(tmp_path, monkeypatch):
+    cache = DiskCache(tmp_path / "cache")
+    cache.put_bytes("ab12", b"data")
+    lookup = cache.lookup
+
+    def lookup_then_evict(key, suffix=""):
+        path = lookup(key, suffix)
+        path.unlink()
+        return path
+
+    monkeypatch.setattr(cache, "lookup", lookup_then_evict)
+    assert not cache.fetch("ab12", tmp_path / "out")
+    cache.put_bytes("ab12", b"data")
+    assert cache.get_bytes("ab12") is None
+    assert cache.snapshot()["misses"] == 2
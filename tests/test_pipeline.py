@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import types
+import pytest
+
+pipeline = pytest.importorskip("pipeline", exc_type=ImportError)
+
+
+class FakeJobs:
+    def __init__(self):
+        self.claimed = []
+
+    def claim(self, pdf_hash, config_hash, job):
+        self.claimed.append(job["job_id"])
+        return dict(job, state="running"), True
+
+    def started(self, job_id, task_ids):
+        pass
+
+
+class FakeApp:
+    def signature(self, name, args, kwargs, priority):
+        return name
+
+
+@pytest.fixture
+def submit(monkeypatch, tmp_path):
+    fake_jobs = FakeJobs()
+    monkeypatch.setattr(pipeline, "jobs", fake_jobs)
+    result = types.SimpleNamespace(id="task", parent=None)
+    monkeypatch.setattr(pipeline, "chain", lambda *stages: types.SimpleNamespace(apply_async=lambda: result))
+    config = {"LISTENABLE": {"regenerate": "False"}, "TTS": {"tts_method": "TTS_OPENAI"}, "TTS_OPENAI": {}}
+
+    def submit(deduplicate=True, regenerate=False):
+        monkeypatch.setattr(pipeline, "worker_option", lambda section, key, fallback=None, type=str: deduplicate)
+        config["LISTENABLE"]["regenerate"] = str(regenerate)
+        return pipeline.PdfPipeline(FakeApp()).submit(b"%PDF", tmp_path, 0, config, "job")
+    submit.jobs = fake_jobs
+    return submit
+
+def test_deduplicated_submission_is_running(submit):
+    job = submit()
+    assert job["state"] == "running" and not job["attached"]
+    assert submit.jobs.claimed == ["job"]
+
+@pytest.mark.parametrize("options", [{"regenerate": True}, {"deduplicate": False}])
+def test_submission_without_deduplication_is_running(submit, options):
+    job = submit(**options)
+    assert job["state"] == "running" and not job["attached"]
+    assert job["task_ids"] == ["task"]
+    assert submit.jobs.claimed == []
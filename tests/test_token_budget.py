@@ -0,0 +1,41 @@
+# SPDX-FileCopyrightText: 2025 Meinhard Kissich
+# SPDX-License-Identifier: MIT
+
+import pytest
+from task.token_budget import budget_sections, count_tokens, split_paragraphs, text_budget
+
+
+def config(token_budget, system_prompt="", user_prompt_template="{context}{text}"):
+    return {"LISTENABLE": {"token_budget": str(token_budget), "tokenizer": "",
+                           "system_prompt": system_prompt, "user_prompt_template": user_prompt_template}}
+
+def test_disabled_budget_keeps_sections():
+    titles, texts = ["# A", "# B"], ["# A" + "a" * 400, "# B" + "b" * 400]
+    assert budget_sections(titles, texts, config(0)) == (titles, texts)
+
+def test_budget_leaves_room_for_prompts_and_context():
+    # 40 tokens of prompts, the rest is shared by the text and a context of up to two sections
+    assert text_budget(config(340, system_prompt="s" * 80, user_prompt_template="p" * 80 + "{context}{text}")) == 100
+    with pytest.raises(ValueError):
+        text_budget(config(40, system_prompt="s" * 160))
+
+def test_split_at_paragraphs_with_running_count():
+    text = "\n\n".join(["a" * 40] * 5)
+    titles, parts, sizes = split_paragraphs("# A", text, 25, config(0))
+    assert titles == ["# A (part 1)", "# A (part 2)", "# A (part 3)"]
+    assert parts == ["a" * 40 + "\n\n" + "a" * 40] * 2 + ["a" * 40]
+    assert sizes == [20, 20, 10]
+
+def test_oversized_paragraph_is_split_at_sentences():
+    sentence = "x" * 38 + "."
+    titles, parts, sizes = split_paragraphs("# A", " ".join([sentence] * 4), 25, config(0))
+    assert parts == [sentence + " " + sentence] * 2
+    assert all(size <= 25 for size in sizes)
+
+def test_small_neighbours_are_merged_and_split_parts_are_not():
+    titles = ["# A", "# B", "# C"]
+    texts = ["a" * 16, "b" * 16, "\n\n".join(["c" * 240] * 2)]
+    merged_titles, merged_texts = budget_sections(titles, texts, config(300))
+    assert merged_titles == ["# A", "# C (part 1)", "# C (part 2)"]
+    assert merged_texts == ["a" * 16 + "\n\n" + "b" * 16, "c" * 240, "c" * 240]
+    assert all(count_tokens(text, config(300)) <= 100 for text in merged_texts)